@@ -0,0 +1,30 @@
+# Author: Ramon Sanchez
+# Last Updated: August 2025
+#
+# Startup benchmark for the Trace Maker GUI.
+# It launches the GUI several times with --startup-benchmark and measures the wall time from
+# starting the Python interpreter to the first interactive frame, so cold start regressions
+# (for example a heavy module imported at the top of the script again) show up immediately.
+#
+# Usage: python Startup_Benchmark.py [number of runs]
+
+import os
+import sys
+import subprocess
+import time
+
+script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Trace_Maker_Python2.7_GUI.py")
+runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+launch_times = []
+for run in range(runs):
+    start = time.time()
+    process = subprocess.Popen([sys.executable, script, "--startup-benchmark"], stdout=subprocess.PIPE)
+    report = process.stdout.readline().strip()
+    launch_times.append(time.time() - start)
+    process.wait()
+    print("Run {}: {:.3f} s launch to first frame | {}".format(run + 1, launch_times[-1], report))
+
+launch_times.sort()
+print("Best: {:.3f} s, median: {:.3f} s, worst: {:.3f} s".format(
+    launch_times[0], launch_times[len(launch_times) // 2], launch_times[-1]))
@@ -11,29 +11,713 @@
 # - Tunnel (via) support for multi-layer routing
 # - Organized saving and loading of design files
 #
-# This version focuses on direct interaction and usability, without animation or scripted replay.
+# This version focuses on direct interaction and usability. Sessions can be recorded and replayed,
+# at their recorded speed or headless.
 # It is ideal for prototyping soft electronics, stretchable circuits, and educational circuit design.
 
+import time
+START_TIME = time.time()  # Reference for the startup benchmark, taken before any other import
+
 import os
+import sys
+import argparse
 import Tkinter as tk
 from Tkinter import *
 import tkFileDialog
 import ttk
 import csv
-import pandas as pd
+import hashlib
 import numpy as np
 import math
+import threading
+import Queue
+import struct
+import zlib
+from array import array
+from collections import OrderedDict
 from time import sleep
-from PIL import Image, ImageTk
 
+# pandas, PIL and shapely are slow to import and are not needed to draw a design, so they are
+# imported on first use by import_pandas(), import_pil_draw() and import_shapely() to keep the startup fast.
+pd = None
+Image = None
+ImageDraw = None
+shapely = None
+
+
+def import_pandas():
+    """Import pandas on demand (analytics only) and return the module."""
+    global pd
+    if pd is None:
+        import pandas as pd
+    return pd
+
+
+def import_pil_draw():
+    """Import the PIL modules the offscreen rasterizer needs, without Tkinter."""
+    global Image, ImageDraw
+    if ImageDraw is None:
+        from PIL import Image, ImageDraw
+    return Image, ImageDraw
+
+
+def import_shapely():
+    """Import shapely on demand (conductor outlines only) and return the package."""
+    global shapely
+    if shapely is None:
+        import shapely.geometry
+        import shapely.ops
+        import shapely.wkb
+    return shapely
+
+
+def to_number(value):
+    """Convert a CSV cell to an int or a float when it holds a number, otherwise return it unchanged."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return value
+
+
+def parse_coordinates(text):
+    """Parse a "[x0, x1, ...]" CSV cell into a typed array of floats."""
+    text = str(text).strip()[1:-1]
+    return array("d", [float(value) for value in text.split(",") if value.strip()])
+
+
+def read_csv_rows(filename):
+    """Read a design CSV file and return its header and data rows, skipping blank lines."""
+    with open(filename, "rb") as f:
+        rows = [row for row in csv.reader(f) if row]
+    if not rows:
+        return [], []
+    return rows[0], rows[1:]
+
+
+def write_csv_rows(filename, header, rows):
+    """Write a header and data rows to a design CSV file, replacing its content."""
+    with open(filename, "wb") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def read_library(filename_pp):
+    """Read the component library with its numeric cells converted, indexed by component name."""
+    header, rows = read_csv_rows(filename_pp)
+    library = {}
+    for row in rows:
+        values = [row[0]]
+        for value in row[1:]:
+            try:
+                values.append(float(value))
+            except ValueError:
+                values.append(value)
+        library.setdefault(row[0], values)
+    return library
+
+
+def calculate_perimeter_top(row, x_center, y_center, theta, num_points, scaling_factor):
+    """Calculate the top perimeter of the component."""
+    y_top = y_center + scaling_factor * row[2] / 2
+    y_top = y_top * np.ones(num_points)
+    x_top = np.linspace(
+        x_center - scaling_factor * row[1] / 2,
+        x_center + scaling_factor * row[1] / 2,
+        num_points
+    )
+    if len(x_top) > len(y_top):
+        x_top = x_top[:-1]
+    x_top, y_top = rotate_coordinates(x_top, y_top, x_center, y_center, theta)
+    return x_top, y_top
+
+
+def calculate_perimeter_right(row, x_center, y_center, theta, num_points, scaling_factor):
+    """Calculate the right perimeter of the component."""
+    y_right = np.linspace(
+        y_center - scaling_factor * row[2] / 2,
+        y_center + scaling_factor * row[2] / 2,
+        num_points
+    )
+    x_right = x_center + scaling_factor * row[1] / 2
+    x_right = x_right * np.ones(num_points)
+    x_right, y_right = rotate_coordinates(x_right, y_right, x_center, y_center, theta)
+    return x_right, y_right
+
+
+def calculate_perimeter_bottom(row, x_center, y_center, theta, num_points, scaling_factor):
+    """Calculate the bottom perimeter of the component."""
+    y_bottom = y_center - scaling_factor * row[2] / 2
+    y_bottom = y_bottom * np.ones(num_points)
+    x_bottom = np.linspace(
+        x_center - scaling_factor * row[1] / 2,
+        x_center + scaling_factor * row[1] / 2,
+        num_points
+    )
+    if len(x_bottom) > len(y_bottom):
+        x_bottom = x_bottom[:-1]
+    x_bottom, y_bottom = rotate_coordinates(x_bottom, y_bottom, x_center, y_center, theta)
+    return x_bottom, y_bottom
+
+
+def calculate_perimeter_left(row, x_center, y_center, theta, num_points, scaling_factor):
+    """Calculate the left perimeter of the component."""
+    y_left = np.linspace(
+        y_center - scaling_factor * row[2] / 2,
+        y_center + scaling_factor * row[2] / 2,
+        num_points
+    )
+    x_left = x_center - scaling_factor * row[1] / 2
+    x_left = x_left * np.ones(num_points)
+    x_left, y_left = rotate_coordinates(x_left, y_left, x_center, y_center, theta)
+    return x_left, y_left
+
+
+def rotate_coordinates(x_coords, y_coords, x_center, y_center, theta):
+    """Rotate coordinates around a center point."""
+    x_coords = np.asarray(x_coords, dtype=float)
+    y_coords = np.asarray(y_coords, dtype=float)
+    x_rotated = x_center + (x_coords - x_center) * math.cos(theta) - (y_coords - y_center) * math.sin(theta)
+    y_rotated = y_center + (x_coords - x_center) * math.sin(theta) + (y_coords - y_center) * math.cos(theta)
+    return x_rotated, y_rotated
+
+
+def adjust_pins(pins_x_coordinate, pins_y_coordinate, row, x_top, y_top, x_bottom, y_bottom, x_right, y_right, x_left, y_left, scaling_factor):
+    """Adjust pin coordinates based on overlap with borders."""
+    conn_lead_ind = 8  # Index for connection lead length in the CSV file
+
+    # Determine the borders of the component
+    x_borders = [x_top[0], x_bottom[0], x_right[0], x_left[0]]
+    y_borders = [y_top[0], y_bottom[0], y_right[0], y_left[0]]
+    right_border_x = max(x_borders)
+    left_border_x = min(x_borders)
+    top_border_y = max(y_borders)
+    bottom_border_y = min(y_borders)
+
+    # Adjust pin coordinates based on their position relative to the borders
+    for pins_total in range(len(pins_x_coordinate)):
+        if pins_x_coordinate[pins_total] >= right_border_x:
+            # Pin is on the right border
+            pins_x_coordinate[pins_total] -= row[conn_lead_ind] * scaling_factor
+        elif pins_x_coordinate[pins_total] <= left_border_x:
+            # Pin is on the left border
+            pins_x_coordinate[pins_total] += row[conn_lead_ind] * scaling_factor
+        elif pins_y_coordinate[pins_total] >= top_border_y:
+            # Pin is on the top border
+            pins_y_coordinate[pins_total] -= row[conn_lead_ind] * scaling_factor
+        elif pins_y_coordinate[pins_total] <= bottom_border_y:
+            # Pin is on the bottom border
+            pins_y_coordinate[pins_total] += row[conn_lead_ind] * scaling_factor
+
+    return pins_x_coordinate, pins_y_coordinate
+
+
+def compute_footprint(row, component_selected, theta, num_points, scaling_factor):
+    """Calculate the pins and perimeter of a component placed at (0, 0) and rotated by theta."""
+    pins_ind = 7  # Index for the number of pins
+    coordinate_x_ind = 9  # Index for the first x-coordinate of pin #1
+    offset_usb = -1  # Offset needed for USB components
+
+    num_pins = int(row[pins_ind])
+    coordinate_y_ind = coordinate_x_ind + num_pins
+
+    # Calculate rotated pin coordinates
+    x = np.array(row[coordinate_x_ind:coordinate_x_ind + num_pins], dtype=float)
+    y = np.array(row[coordinate_y_ind:coordinate_y_ind + num_pins], dtype=float)
+    pins_x_coordinate = scaling_factor * (x * math.cos(theta) - y * math.sin(theta))
+    pins_y_coordinate = -scaling_factor * (x * math.sin(theta) + y * math.cos(theta))
+
+    if component_selected == 'USB':
+        pins_y_coordinate = pins_y_coordinate + offset_usb
+
+    # Define the perimeter as an obstacle
+    x_top, y_top = calculate_perimeter_top(row, 0.0, 0.0, theta, num_points, scaling_factor)
+    x_right, y_right = calculate_perimeter_right(row, 0.0, 0.0, theta, num_points, scaling_factor)
+    x_bottom, y_bottom = calculate_perimeter_bottom(row, 0.0, 0.0, theta, num_points, scaling_factor)
+    x_left, y_left = calculate_perimeter_left(row, 0.0, 0.0, theta, num_points, scaling_factor)
+
+    # Adjust pin connections based on overlap
+    pins_x_coordinate, pins_y_coordinate = adjust_pins(
+        pins_x_coordinate, pins_y_coordinate, row, x_top, y_top, x_bottom, y_bottom, x_right, y_right, x_left, y_left, scaling_factor
+    )
+
+    template = (pins_x_coordinate, pins_y_coordinate, x_top, y_top, x_bottom, y_bottom, x_right, y_right, x_left, y_left)
+    for values in template:
+        values.flags.writeable = False  # Templates are shared between placements
+    return template
+
+
+class FootprintCache(object):
+    """Bounded cache of footprint templates keyed by (component, angle, scaling factor).
+
+    A template holds the pin offsets and perimeter arrays of a component placed at (0, 0), so
+    placing an instance is a single array translation. The templates and the library rows are
+    dropped when the library file changes on disk. One cache is shared by the whole process.
+    """
+
+    def __init__(self, max_templates=512):
+        self.max_templates = max_templates
+        self.templates = OrderedDict()
+        self.library_rows = {}
+        self.library_file = None
+        self.library_mtime = None
+        self.lock = threading.Lock()  # The design loader computes geometry in a worker thread
+
+    def check_library(self, filename_pp):
+        """Reload the library and invalidate the templates if the library file changed."""
+        mtime = os.path.getmtime(filename_pp)
+        if filename_pp != self.library_file or mtime != self.library_mtime:
+            self.library_rows = read_library(filename_pp)
+            self.library_file = filename_pp
+            self.library_mtime = mtime
+            self.templates.clear()
+
+    def library(self, filename_pp):
+        """Return the component library rows indexed by component name."""
+        with self.lock:
+            self.check_library(filename_pp)
+            return self.library_rows
+
+    def template(self, filename_pp, component_selected, theta, num_points, scaling_factor):
+        """Return the footprint template of a component, computing it on the first request."""
+        angle = int(round(math.degrees(theta))) % 360  # Rotations only happen in 90 degree steps
+        key = (component_selected, angle, scaling_factor, num_points)
+        with self.lock:
+            self.check_library(filename_pp)
+            template = self.templates.pop(key, None)
+            if template is None:
+                template = compute_footprint(
+                    self.library_rows[component_selected], component_selected, math.radians(angle), num_points, scaling_factor
+                )
+            self.templates[key] = template  # Most recently used templates are kept at the end
+            while len(self.templates) > self.max_templates:
+                self.templates.popitem(last=False)
+            return template
+
+
+footprints = FootprintCache()
+SCALING_FACTOR = 5  # Scaling factor for the GUI elements to be visible
+
+
+def place_footprint(filename_pp, x_center, y_center, num_points, component_selected, theta, scaling_factor):
+    """Return the pins and perimeter of a component placed at (x_center, y_center)."""
+    template = footprints.template(filename_pp, component_selected, theta, num_points, scaling_factor)
+    return tuple(
+        values + (x_center if i % 2 == 0 else y_center) for i, values in enumerate(template)
+    )
+
+
+class PinTable(object):
+    """Compact table of the pins of every placed component, used to snap traces to pins.
+
+    Pins are stored in a numpy structured array. Component names and tags are interned, so each
+    pin only holds two integer ids. Slots freed by removing a component are reused by the next
+    placement, and the slots of every tag are indexed so a component's pins are removed at once.
+    A uniform grid of cell_size pixels indexes the slots by position, so snapping a point to a
+    pin only looks at the few pins around it.
+    """
+
+    pin_dtype = np.dtype([("x", "f8"), ("y", "f8"), ("component", "i4"), ("tag", "i4"), ("index", "i4"), ("used", "?")])
+
+    def __init__(self, capacity=256, cell_size=10.0):
+        self.pins = np.zeros(capacity, dtype=self.pin_dtype)
+        self.cell_size = cell_size
+        self.grid = {}  # (column, row) of a grid cell -> slots of the pins inside it
+        self.size = 0  # High-water mark, slots past it have never been used
+        self.free_slots = []
+        self.names = []  # Interned component names and tags, a pin stores their index
+        self.name_ids = {}
+        self.slots_by_tag = {}
+
+    def __len__(self):
+        return self.size - len(self.free_slots)
+
+    def intern(self, name):
+        """Return the id of a component name or tag, adding it on first use."""
+        name_id = self.name_ids.get(name)
+        if name_id is None:
+            name_id = len(self.names)
+            self.names.append(name)
+            self.name_ids[name] = name_id
+        return name_id
+
+    def allocate(self, count):
+        """Return count free slots, reusing freed slots first and growing the array when full."""
+        slots = self.free_slots[-count:] if count else []
+        del self.free_slots[len(self.free_slots) - len(slots):]
+        missing = count - len(slots)
+        if missing:
+            if self.size + missing > len(self.pins):
+                grown = np.zeros(max(2 * len(self.pins), self.size + missing), dtype=self.pin_dtype)
+                grown[:self.size] = self.pins[:self.size]
+                self.pins = grown
+            slots.extend(range(self.size, self.size + missing))
+            self.size += missing
+        return slots
+
+    def add(self, component, tag, x_pins, y_pins):
+        """Add the pins of a placed component."""
+        slots = self.allocate(len(x_pins))
+        if not slots:
+            return
+        tag_id = self.intern(tag)
+        rows = self.pins[slots]
+        rows["x"] = x_pins
+        rows["y"] = y_pins
+        rows["component"] = self.intern(component)
+        rows["tag"] = tag_id
+        rows["index"] = np.arange(len(slots))
+        rows["used"] = True
+        self.pins[slots] = rows
+        self.slots_by_tag.setdefault(tag_id, []).extend(slots)
+        for slot, x, y in zip(slots, rows["x"], rows["y"]):
+            self.grid.setdefault(self.cell(x, y), []).append(slot)
+
+    def cell(self, x, y):
+        """Return the grid cell that contains (x, y)."""
+        return int(math.floor(x / self.cell_size)), int(math.floor(y / self.cell_size))
+
+    def remove(self, tag):
+        """Remove all the pins of the component with the given tag."""
+        tag_id = self.name_ids.get(tag)
+        slots = self.slots_by_tag.pop(tag_id, None)
+        if slots:
+            for slot in slots:
+                cell = self.cell(self.pins["x"][slot], self.pins["y"][slot])
+                self.grid[cell].remove(slot)
+                if not self.grid[cell]:
+                    del self.grid[cell]
+            self.pins["used"][slots] = False
+            self.free_slots.extend(slots)
+
+    def snap(self, x, y, radius):
+        """Return the slot of the pin closest to (x, y) if it is closer than radius, otherwise None."""
+        column_min, row_min = self.cell(x - radius, y - radius)
+        column_max, row_max = self.cell(x + radius, y + radius)
+        closest = None
+        closest_dist = radius
+        for column in range(column_min, column_max + 1):
+            for row in range(row_min, row_max + 1):
+                for slot in self.grid.get((column, row), ()):
+                    dist = math.hypot(self.pins["x"][slot] - x, self.pins["y"][slot] - y)
+                    if dist < closest_dist:
+                        closest = slot
+                        closest_dist = dist
+        return closest
+
+    def find(self, tag, x, y, tolerance):
+        """Return the index of the pin of a component closest to (x, y), or None if none is within tolerance."""
+        slots = self.slots_by_tag.get(self.name_ids.get(tag))
+        if not slots:
+            return None
+        pins = self.pins[slots]
+        dist = np.hypot(pins["x"] - x, pins["y"] - y)
+        closest = int(np.argmin(dist))
+        if dist[closest] >= tolerance:
+            return None
+        return int(pins["index"][closest])
+
+    def pin(self, slot):
+        """Return the coordinates, component name, tag and index of the pin in a slot."""
+        row = self.pins[slot]
+        return float(row["x"]), float(row["y"]), self.names[row["component"]], self.names[row["tag"]], int(row["index"])
+
+
+class PinConnections(object):
+    """Deduplicated pin connections of a design, keyed by (component tag, pin index, trace tag).
+
+    Connections live in a hash index, so a pin clicked twice or a trace replayed by load_design
+    is rejected on insert instead of adding a row to the Pins_Coordinates file, and the file is
+    rewritten compacted from the index. The connections of a component or a trace are found in
+    two more indexes, by component tag and by trace tag. Rows of older files, saved without the
+    pin index and the trace tag, are resolved against the placed pins and the trace vertices.
+    """
+
+    header = ["X", "Y", "Component", "Tag", "Pin", "Trace"]
+
+    def __init__(self, snap_distance=3.0):
+        self.snap_distance = snap_distance
+        self.connections = OrderedDict()
+        self.by_tag = {}  # Component tag -> keys of its connections
+        self.by_trace = {}  # Trace tag -> keys of its connections
+        self.version = 0  # Incremented on every change, to know when the file has to be written
+        self.vertex_traces = {}  # Rounded trace vertex -> trace tag, to resolve rows of older files
+
+    def __len__(self):
+        return len(self.connections)
+
+    def add(self, x, y, component, tag, pin, trace):
+        """Add a connection, return False if it is already in the table."""
+        key = (tag, pin, trace)
+        if key in self.connections:
+            return False
+        self.connections[key] = (x, y, component)
+        self.by_tag.setdefault(tag, set()).add(key)
+        self.by_trace.setdefault(trace, set()).add(key)
+        self.version += 1
+        return True
+
+    def add_trace(self, x, y, trace, pins):
+        """Add the connections of every vertex of a saved trace that lies on a pin."""
+        for x_vertex, y_vertex in zip(x, y):
+            self.vertex_traces.setdefault((round(x_vertex, 2), round(y_vertex, 2)), trace)
+            slot = pins.snap(x_vertex, y_vertex, self.snap_distance)
+            if slot is not None:
+                x_pin, y_pin, component, tag, pin = pins.pin(slot)
+                self.add(x_vertex, y_vertex, component, tag, pin, trace)
+
+    def add_row(self, row, pins):
+        """Add a row of a Pins_Coordinates file, return False if it is a duplicate or matches no pin."""
+        x, y, component, tag = float(row[0]), float(row[1]), row[2], row[3]
+        if len(row) >= 6 and row[4] != "":
+            pin, trace = int(row[4]), row[5]
+        else:
+            pin = pins.find(tag, x, y, self.snap_distance)
+            if pin is None:
+                return False
+            trace = self.vertex_traces.get((round(x, 2), round(y, 2)), "")
+        return self.add(x, y, component, tag, pin, trace)
+
+    def remove(self, tag=None, trace=None):
+        """Remove the connections of a component tag or of a trace tag."""
+        keys = self.by_tag.pop(tag, set()) | self.by_trace.pop(trace, set())
+        for key in keys:
+            del self.connections[key]
+            self.by_tag.get(key[0], set()).discard(key)
+            self.by_trace.get(key[2], set()).discard(key)
+        if keys:
+            self.version += 1
+
+    def write(self, filename):
+        """Write the connections to a Pins_Coordinates file, one row per connection."""
+        rows = [
+            [x, y, component, tag, pin, trace]
+            for (tag, pin, trace), (x, y, component) in self.connections.items()
+        ]
+        write_csv_rows(filename, self.header, rows)
+
+
+DEFAULT_LAYERS = [
+    # Name, colour, line width. Layer 0 is the base layer and layer 1 the tunnel layer of older designs
+    ["Base", "gray50", 1],
+    ["Tunnel", "#bf9000", 3],
+]
+LAYER_PALETTE = ["#008080", "#b03060", "#2e8b57", "#6a5acd", "#d2691e", "#4682b4"]
+
+
+class LayerStack(object):
+    """Named conductive layers of a design, with a colour, a line width and a visibility each.
+
+    The index of a layer is the value saved in the Tunnel column of the traces file, so designs
+    with a single tunnel layer load unchanged. Every trace segment is tagged with the canvas tag
+    of its layer, which makes hiding or showing a layer a single tag operation.
+    """
+
+    header = ["Layer", "Name", "Color", "Width"]
+
+    def __init__(self, layers=None):
+        if layers is None:
+            layers = DEFAULT_LAYERS
+        self.names = [name for name, color, width in layers]
+        self.colors = [color for name, color, width in layers]
+        self.widths = [width for name, color, width in layers]
+        self.visible = [True] * len(layers)
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def read(cls, filename):
+        """Read the layers of a design, older designs without a layers file get the default layers."""
+        if filename is None or not os.path.exists(filename):
+            return cls()
+        header, rows = read_csv_rows(filename)
+        return cls([[row[1], row[2], float(row[3])] for row in sorted(rows, key=lambda row: int(row[0]))])
+
+    def write(self, filename):
+        """Write the layers of a design."""
+        rows = [[layer, self.names[layer], self.colors[layer], self.widths[layer]] for layer in range(len(self))]
+        write_csv_rows(filename, self.header, rows)
+
+    def layer(self, value):
+        """Return the layer index saved in a Tunnel cell."""
+        return int(float(value))
+
+    def ensure(self, layer):
+        """Add layers up to a layer index, for designs whose traces use more layers than are defined."""
+        while layer >= len(self):
+            self.colors.append(LAYER_PALETTE[(len(self) - len(DEFAULT_LAYERS)) % len(LAYER_PALETTE)])
+            self.names.append("Layer {}".format(len(self)))
+            self.widths.append(2)
+            self.visible.append(True)
+
+    def tag(self, layer):
+        """Return the canvas tag shared by every trace segment of a layer."""
+        return "layer_{}".format(layer)
+
+    def line_options(self, layer):
+        """Return the create_line options that draw a trace segment on a layer."""
+        return {
+            "fill": self.colors[layer],
+            "width": self.widths[layer],
+            "state": "normal" if self.visible[layer] else "hidden",
+        }
+
+
+def design_filenames(path):
+    """Return the traces, components, base, pins and layers filenames of a design folder."""
+    name = os.path.basename(os.path.normpath(path))
+    return (
+        "{}/Traces_Coordinates_{}.csv".format(path, name),
+        "{}/PP_List_Coordinates_{}.csv".format(path, name),
+        "{}/Base_Coordinates_{}.csv".format(path, name),
+        "{}/Pins_Coordinates_{}.csv".format(path, name),
+        "{}/Layers_{}.csv".format(path, name),
+    )
+
+
+def clean_pin_connections(path, filename_pp="Pick_and_place_components_with_pads.csv", scaling_factor=SCALING_FACTOR):
+    """Deduplicate and compact the Pins_Coordinates file of a design folder, return the row counts before and after."""
+    filename, filename_pp_coord, filename_base, filename_pins_selected, filename_layers = design_filenames(path)
+
+    # Place the components to know where their pins are
+    pins = PinTable()
+    header, components = read_csv_rows(filename_pp_coord)
+    for row in components:
+        geometry = place_footprint(
+            filename_pp, float(row[1]), float(row[2]), 20, row[0], math.radians(float(row[3])), scaling_factor
+        )
+        pins.add(row[0], row[6], geometry[0], geometry[1])
+
+    connections = PinConnections()
+    header, traces = read_csv_rows(filename)
+    for row in traces:
+        connections.add_trace(parse_coordinates(row[1]), parse_coordinates(row[2]), row[3], pins)
+    header, pin_rows = read_csv_rows(filename_pins_selected)
+    for row in pin_rows:
+        connections.add_row(row, pins)
+
+    connections.write(filename_pins_selected)
+    return len(pin_rows), len(connections)
+
+
+class DesignWatcher(object):
+    """Rows of design files as the canvas shows them, to find the rows edited outside the GUI.
+
+    The rows the GUI writes itself are taken as seen from memory, without reading the file. A
+    file edited outside the GUI is read, hashed and parsed again whole, which costs the size of
+    the file. Rows are grouped by their tag and the added, removed and changed tags are found
+    with dictionary lookups, so only the canvas work is limited to the edited rows. A tag saved
+    on several rows (empty Saves of older versions repeated the last trace tag) is one group,
+    redrawn whole when any of its rows changes. Rows are compared by their parsed values, so a
+    file written again with another number format has no changes.
+    """
+
+    def __init__(self):
+        self.files = {}  # Filename -> (mtime and size, content hash, parsed rows of every tag)
+
+    @staticmethod
+    def values(row):
+        """Return the values of a row, numbers and coordinate lists parsed so their format does not matter."""
+        return [tuple(parse_coordinates(cell)) if str(cell).strip().startswith("[") else to_number(cell) for cell in row]
+
+    def wrote(self, filename, tag_column, added=(), removed=()):
+        """Take the rows the GUI itself appended to or removed from a file as seen, without reading it again."""
+        if not os.path.exists(filename):
+            return
+        seen = self.files.get(filename)
+        values = seen[2] if seen is not None else OrderedDict()
+        for row in removed:
+            tag_values = values.get(row[tag_column], [])
+            if self.values(row) in tag_values:
+                tag_values.remove(self.values(row))
+            if not tag_values:
+                values.pop(row[tag_column], None)
+        for row in added:
+            values.setdefault(row[tag_column], []).append(self.values(row))
+        status = os.stat(filename)
+        self.files[filename] = ((status.st_mtime, status.st_size), None, values)
+
+    def rows(self, filename, tag):
+        """Return the parsed rows of a tag as last seen, an empty list if the tag was not in the file."""
+        seen = self.files.get(filename)
+        return seen[2].get(tag, []) if seen is not None else []
+
+    def changes(self, filename, tag_column):
+        """Return the added (tag, rows), removed tags and changed (tag, rows) of a file since it was last seen.
+
+        Returns None if the file did not change.
+        """
+        if not os.path.exists(filename):
+            return None
+        status = os.stat(filename)
+        signature = (status.st_mtime, status.st_size)
+        seen = self.files.get(filename)
+        if seen is not None and seen[0] == signature:
+            return None
+        with open(filename, "rb") as f:
+            data = f.read()
+        digest = hashlib.md5(data).hexdigest()
+        if seen is not None and seen[1] == digest:
+            self.files[filename] = (signature, digest, seen[2])
+            return None
+
+        rows = OrderedDict()
+        values = {}
+        for row in list(csv.reader(data.splitlines()))[1:]:
+            if row:
+                rows.setdefault(row[tag_column], []).append(row)
+                values.setdefault(row[tag_column], []).append(self.values(row))
+        self.files[filename] = (signature, digest, values)
+        old_values = seen[2] if seen is not None else {}
+        added = [(tag, tag_rows) for tag, tag_rows in rows.items() if tag not in old_values]
+        removed = [tag for tag in old_values if tag not in rows]
+        changed = [(tag, tag_rows) for tag, tag_rows in rows.items() if tag in old_values and old_values[tag] != values[tag]]
+        return added, removed, changed
+
+
+class SessionLog(object):
+    """Compact log of the actions of a GUI session, replayed by TraceMakerApp.replay.
+
+    One CSV row per action: the time in milliseconds since the session started, the action and
+    its values (click position, component, layer, design name). Mouse motion only moves the
+    trace preview and is not recorded. Rows are flushed as they are written.
+    """
+
+    header = ["Time", "Action", "Value 1", "Value 2"]
+
+    def __init__(self, filename):
+        self.file = open(filename, "wb")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(self.header)
+        self.start = time.time()
+
+    def write(self, action, *values):
+        """Append an action to the log."""
+        self.writer.writerow([int(round((time.time() - self.start) * 1000)), action] + list(values))
+        self.file.flush()
+
+    def close(self):
+        """Close the log file."""
+        self.file.close()
+
+    @staticmethod
+    def read(filename):
+        """Return the (time, action, values) of every action of a log."""
+        header, rows = read_csv_rows(filename)
+        return [(int(row[0]), row[1], row[2:]) for row in rows]
 
 
 class TraceMakerApp:
-    def __init__(self, root):
+    def __init__(self, root, session=None):
         self.root = root
+        self.session = session  # SessionLog the user actions are recorded to, None when not recording
         self.root.geometry("1900x1000")
         self.root.title("Trace Maker GUI")
-        self.scaling_factor = 5  # Scaling factor for the GUI elements to be visible
+        self.scaling_factor = SCALING_FACTOR
 
         # Define the device dimensions
         self.origin_x = 2 # These set a margin for the workspace line to be visible in the interface
@@ -47,24 +731,34 @@ class TraceMakerApp:
         self.background = 'white'
         self.coord_x = []
         self.coord_y = []
-        self.x_pin_points = []
-        self.y_pin_points = []
-        self.component_here = []  # Wherever x_pin_points and y_pin_points are defined, we also add to this vector the component to where the pins correspond to at a given instance
-        self.component_tag_here = []  # Wherever x_pin_points and y_pin_points are defined, we also add to this vector the component tag
+        self.pins = PinTable()  # Pins of every placed component, with the component name and tag they belong to
         self.here = 0
         self.here_comp = 0
         self.comp_selected = 0
-        self.tunnel = 0
+        self.tunnel = 0  # Active layer, 0 is the base layer and 1 the tunnel layer
+        self.layers = LayerStack()
         self.delete_here = 0
         self.degree = 0
         self.old_comp = 0
-        self.pin_instances = 0
+        self.connections = PinConnections()  # Pin connections of the design, saved to filename_pins_selected
+        self.trace_pins = []  # Pins clicked in the current trace, connected once the trace is saved
+        self.snap_distance = 3.0  # [Pixels] a click closer than this to a pin snaps to it
+        self.preview_frame_ms = 16  # [ms] the trace preview is updated at most once per frame
+        self.preview_pending = None  # root.after id of the scheduled preview update
+        self.preview_xy = None  # Last mouse position, only the latest one is drawn
+        self.preview_style = None
         self.same_line = 0
         self.line_tag = 0
         self.load = 0
-        self.tag_line_vector = []
-        self.tag_comp_vector = [] 
+        self.tag_line_vector = set()
+        self.tag_comp_vector = set()
         self.counter = 0
+        self.loading = False  # True while load_design is inserting a design on the canvas
+        self.load_poll_ms = 10  # [ms] delay between two chunks of a progressive load
+        self.load_frame_budget = 0.015  # [s] time spent drawing per chunk, keeps the GUI responsive
+        self.watcher = DesignWatcher()  # Components and traces files as drawn, to apply edits made outside the GUI
+        self.watch_ms = 500  # [ms] delay between two checks of the design files
+        self.watch_pending = None  # root.after id of the next check
 
         # File paths
         self.filename = None
@@ -72,6 +766,7 @@ class TraceMakerApp:
         self.filename_pp_coord = None
         self.filename_base = None
         self.filename_pins_selected = None
+        self.filename_layers = None
 
         # Canvas and UI elements
         self.canvas = tk.Canvas(self.root, width=1900, height=800, bg=self.background)
@@ -81,19 +776,24 @@ class TraceMakerApp:
         # UI setup
         self.create_ui()
 
+        # Rubber-band preview of the next segment and pin highlight, created once and moved with coords()
+        self.preview_line = self.canvas.create_line(0, 0, 0, 0, width=1, fill="gray50", state="hidden", tags=("preview"))
+        self.preview_snap = self.canvas.create_oval(0, 0, 0, 0, outline="red", width=2, state="hidden", tags=("preview"))
+
         # Event bindings
-        self.root.bind('<ButtonPress-1>', self.draw_line)
-        self.root.bind('<ButtonPress-3>', self.save)
+        self.root.bind('<ButtonPress-1>', self.recorded("click", self.draw_line, lambda event: [event.x, event.y], True))
+        self.root.bind('<ButtonPress-3>', self.recorded("save", self.save, ignored_while_loading=True))
+        self.canvas.bind('<Motion>', self.motion_preview)
 
     def create_ui(self):
         """Create the UI elements."""
 
-        tk.Button(self.root, text="Save", width=20, height=1, command=self.save).place(x=1100, y=5)
-        self.button_via = tk.Button(self.root, text="Tunnel", width=20, height=1, fg="black", command=self.via_tunnel)
+        tk.Button(self.root, text="Save", width=20, height=1, command=self.recorded("save", self.save, ignored_while_loading=True)).place(x=1100, y=5)
+        self.button_via = tk.Button(self.root, text="Tunnel", width=20, height=1, fg="black", command=self.recorded("tunnel", self.via_tunnel))
         self.button_via.place(x=1100, y=35)
         self.orig_color = self.button_via.cget("background")
 
-        self.button_rotate = tk.Button(self.root, text="Rotate", width=20, height=1, fg="black", command=self.rotate)
+        self.button_rotate = tk.Button(self.root, text="Rotate", width=20, height=1, fg="black", command=self.recorded("rotate", self.rotate, ignored_while_loading=True))
         self.button_rotate.place(x=1100, y=65)
 
         tk.Label(self.root, text="Select component:", background="RoyalBlue2", foreground="black").place(x=1100, y=95)
@@ -109,18 +809,44 @@ class TraceMakerApp:
             width=20
         )
         self.combo.place(x=1100, y=120)
-        self.combo.bind('<<ComboboxSelected>>', self.combo_callback)
+        self.combo.bind('<<ComboboxSelected>>', self.recorded("select", self.combo_callback, lambda event: [self.combo.get()]))
 
-        tk.Button(self.root, text="Delete", width=20, height=1, command=self.delete).place(x=1100, y=150)
+        tk.Button(self.root, text="Delete", width=20, height=1, command=self.recorded("delete", self.delete, ignored_while_loading=True)).place(x=1100, y=150)
         tk.Button(self.root, text="Load Design", width=20, height=1, command=self.load_design).place(x=1100, y=180)
 
         self.entry = tk.Entry(self.root, text="Name Design", width=20)
         self.entry.place(x=1100, y=220)
         self.entry.insert(0, "Enter design name")
         self.entry.bind("<FocusIn>", self.temp_text)
-        self.entry.bind("<Return>", self.entry_callback)
+        self.entry.bind("<Return>", self.recorded("new", self.entry_callback, lambda event: [self.entry.get()]))
+
+        self.progress_load = ttk.Progressbar(self.root, orient="horizontal", length=150, mode="determinate")
+        self.progress_load.place(x=1100, y=250)
+        self.button_cancel_load = tk.Button(self.root, text="Cancel Load", width=20, height=1, state="disabled", command=self.cancel_load)
+        self.button_cancel_load.place(x=1100, y=275)
+
+        tk.Label(self.root, text="Active layer:", background="RoyalBlue2", foreground="black").place(x=1100, y=310)
+        self.combo_layer = ttk.Combobox(self.root, state="readonly", values=self.layers.names, width=20)
+        self.combo_layer.current(0)
+        self.combo_layer.place(x=1100, y=335)
+        self.combo_layer.bind('<<ComboboxSelected>>', self.recorded("layer", self.layer_callback, lambda event: [self.combo_layer.current()]))
+        self.button_layer = tk.Button(self.root, text="Hide Layer", width=20, height=1, command=self.recorded("toggle_layer", self.toggle_layer))
+        self.button_layer.place(x=1100, y=365)
+        self.button_add_layer = tk.Button(self.root, text="Add Layer", width=20, height=1, command=self.recorded("add_layer", self.add_layer))
+        self.button_add_layer.place(x=1100, y=395)
         self.create_grid()
-        self.canvas.create_rectangle(1075, 0, 1275, 250, fill="RoyalBlue2")
+        self.canvas.create_rectangle(1075, 0, 1275, 430, fill="RoyalBlue2")
+
+    def recorded(self, action, handler, values=lambda event: [], ignored_while_loading=False):
+        """Return an event handler that writes the action to the session log before handling it."""
+        if self.session is None:
+            return handler
+
+        def record(event=None):
+            if not (ignored_while_loading and self.loading):  # The handler would ignore it, so would a replay
+                self.session.write(action, *values(event))
+            return handler() if event is None else handler(event)
+        return record
 
     def create_grid(self):
         """Draw the grid dots on the canvas."""
@@ -139,6 +865,8 @@ class TraceMakerApp:
         #print('Aqui estamos, load es :', self.load)
         """Draw a line between two consecutive points or place a component."""
         #print('X and Y coordinates:', self.x, self.y)
+        if self.loading and event is not None:
+            return  # Ignore clicks on the canvas while a design is being loaded
         if event is not None:
             self.x = event.x
             self.y = event.y
@@ -182,43 +910,20 @@ class TraceMakerApp:
                 text=self.component_selected,
                 tags=(self.tag_name),
             )
-        color_line = "gray50"
-
         if self.comp_selected == 0:
             if self.load == 1:
                 self.x = self.x1
                 self.y = self.y1
 
-            dist_point_to_pins = []
-            if len(self.x_pin_points) > 0:
-                for i in range(len(self.x_pin_points)):
-                    dist_point_to_pins.append(
-                        math.sqrt((self.x_pin_points[i] - self.x) ** 2 + (self.y_pin_points[i] - self.y) ** 2)
-                    )
-
-                if min(dist_point_to_pins) < 3.0:
-                    minpos = dist_point_to_pins.index(min(dist_point_to_pins))
-                    if self.load == 0:
-                        self.x = self.x_pin_points[minpos]
-                        self.y = self.y_pin_points[minpos]
-
-                    corresponding_component = self.component_here[minpos]
-                    corresponding_tag = self.component_tag_here[minpos]
-
-                    if self.pin_instances == 0:
-                        a = "w"
-                    else:
-                        a = "a"
-
-                    with open(self.filename_pins_selected, a) as f:
-                        writer = csv.writer(f)
-                        data = [self.x, self.y, corresponding_component, corresponding_tag]
-                        if a == "w":
-                            first_row = ["X", "Y", "Component", "Tag"]
-                            writer.writerow(first_row)
-                        writer.writerow(data)
+            minpos = self.pins.snap(self.x, self.y, self.snap_distance)
+            if minpos is not None:
+                x_pin, y_pin, corresponding_component, corresponding_tag, pin_index = self.pins.pin(minpos)
+                if self.load == 0:
+                    self.x = x_pin
+                    self.y = y_pin
 
-                    self.pin_instances += 1
+                # The trace tag is only final when the trace is saved, see save
+                self.trace_pins.append((self.x, self.y, corresponding_component, corresponding_tag, pin_index))
 
             self.coord_x.append(self.x)
             self.coord_y.append(self.y)
@@ -232,26 +937,20 @@ class TraceMakerApp:
                 while self.tag_line in self.tag_line_vector:
                     self.line_tag += 1
                     self.tag_line = "line_{}".format(self.line_tag)
-                if self.tunnel == 1:
-                    color_line = "#008080"
-                    self.line = self.canvas.create_line(
-                        self.x, self.y, self.x1, self.y1, dash=(2, 1), fill=color_line, tags=(self.tag_line)
-                    )
-                else:
-                    self.line = self.canvas.create_line(
-                        self.x, self.y, self.x1, self.y1, width=1, fill=color_line, tags=(self.tag_line)
-                    )
+                self.line = self.canvas.create_line(
+                    self.x, self.y, self.x1, self.y1, tags=(self.tag_line, self.layers.tag(self.tunnel)),
+                    **self.layers.line_options(self.tunnel)
+                )
             self.canvas.old_coords = self.x, self.y
 
         elif self.comp_selected == 1 and self.component_selected != "FSR Place":
             # Check how many times a component is used, and assign a tag depending on how many there are
-            df_pp_comps = pd.read_csv(self.filename_pp_coord)
-            comp_list = df_pp_comps.iloc[:][:]
+            header, comp_list = read_csv_rows(self.filename_pp_coord)
             repeated = 0
             for i in range(len(comp_list)):
                 if (
-                    df_pp_comps.iloc[i][0] == self.component_selected
-                    and df_pp_comps.iloc[i][3] == self.degree_here
+                    comp_list[i][0] == self.component_selected
+                    and float(comp_list[i][3]) == self.degree_here
                 ):
                     repeated += 1
             if self.load == 0:
@@ -260,9 +959,9 @@ class TraceMakerApp:
                     while self.tag_name in self.tag_comp_vector:
                         repeated += 1
                         self.tag_name = "{}_{}_{}".format(self.component_selected, repeated, self.degree_here)
-                    self.tag_comp_vector.append(self.tag_name)
+                    self.tag_comp_vector.add(self.tag_name)
                 else:
-                    self.tag_comp_vector.append(self.tag_name)
+                    self.tag_comp_vector.add(self.tag_name)
             else:
                 self.tag_name = self.tag_comp
                 
@@ -302,6 +1001,14 @@ class TraceMakerApp:
             self.x_center = self.x1
             self.y_center = self.y1
             num_points = 20
+            geometry = self.tracer_coordinates(
+                self.filename_pp,
+                self.x_center,
+                self.y_center,
+                num_points,
+                self.component_selected,
+                theta,
+            )
             (
                 self.pins_x_coordinate,
                 self.pins_y_coordinate,
@@ -313,14 +1020,7 @@ class TraceMakerApp:
                 self.y_right,
                 self.x_left,
                 self.y_left,
-            ) = self.tracer_coordinates(
-                self.filename_pp,
-                self.x_center,
-                self.y_center,
-                num_points,
-                self.component_selected,
-                theta,
-            )
+            ) = geometry
             x_perimeter = [
                 np.round_(self.x_top[0], decimals=2),
                 np.round_(self.x_top[-1], decimals=2),
@@ -359,6 +1059,7 @@ class TraceMakerApp:
                         ]
                         writer.writerow(first_row)
                     writer.writerow(data)
+                self.watcher.wrote(self.filename_pp_coord, 6, added=[data])
             elif self.component_selected == self.old_comp and self.degree == 0 and self.load == 0:
                 with open(self.filename_pp_coord, a) as f:
                     writer = csv.writer(f)
@@ -383,85 +1084,99 @@ class TraceMakerApp:
                         ]
                         writer.writerow(first_row)
                     writer.writerow(data)
+                self.watcher.wrote(self.filename_pp_coord, 6, added=[data])
 
             self.coord_x = []
             self.coord_y = []
             self.here_comp = 1
 
-            # Draw an oval in the given coordinates
-            if self.component_selected == "Via":
-                color = "green"
-                w = 3
-                self.canvas.create_oval(
-                    self.x1, self.y1, self.x2, self.y2, fill=color, width=w, tags=self.tag_name
-                )
+            self.draw_component(self.component_selected, self.tag_name, self.x1, self.y1, geometry)
+            self.old_comp = self.component_selected
+            self.comp_selected = 0
 
-            # Draw the component as an obstacle, and the component pins so they're accessible
-            x_vector = []
-            y_vector = []
-            x_vector.extend(self.pins_x_coordinate)
-            x_vector.extend(self.x_top)
-            x_vector.extend(self.x_bottom)
-            x_vector.extend(self.x_right)
-            x_vector.extend(self.x_left)
-            y_vector.extend(self.pins_y_coordinate)
-            y_vector.extend(self.y_top)
-            y_vector.extend(self.y_bottom)
-            y_vector.extend(self.y_right)
-            y_vector.extend(self.y_left)
-            x_vector = np.round_(x_vector, decimals=2)
-            y_vector = np.round_(y_vector, decimals=2)
-            self.x_pin_points.extend(self.pins_x_coordinate)
-            self.y_pin_points.extend(self.pins_y_coordinate)
-            for pin_lengths_here in range(len(self.pins_x_coordinate)):
-                self.component_here.extend([self.component_selected])
-                self.component_tag_here.extend([self.tag_name])
-
-            if self.component_selected == "FSR":
-                df = pd.read_csv(self.filename_pp)
-                for components in range(0, len(df.iloc[:][:])):
-                    if df.iloc[components][0] == "FSR":
-                        self.canvas.create_oval(
-                            self.x_right[0],
-                            self.y_top[0],
-                            self.x_left[0],
-                            self.y_bottom[0],
-                            fill="gray",
-                            width=1,
-                            tags=(self.tag_name),
-                        )
-                        self.canvas.create_oval(
-                            self.pins_x_coordinate[0],
-                            self.pins_y_coordinate[0],
-                            self.pins_x_coordinate[0],
-                            y_vector[0],
-                            fill="black",
-                            width=2,
-                            tags=(self.tag_name),
-                        )
-                        self.canvas.create_oval(
-                            self.pins_x_coordinate[1],
-                            self.pins_y_coordinate[1],
-                            self.pins_x_coordinate[1],
-                            y_vector[1],
-                            fill="black",
-                            width=2,
-                            tags=(self.tag_name),
-                        )
-            else:
-                for i in range(0, len(x_vector)):
+    def draw_component(self, component_selected, tag_name, x_center, y_center, geometry):
+        """Draw a placed component on the canvas and register its pins for snapping."""
+        (
+            self.pins_x_coordinate,
+            self.pins_y_coordinate,
+            self.x_top,
+            self.y_top,
+            self.x_bottom,
+            self.y_bottom,
+            self.x_right,
+            self.y_right,
+            self.x_left,
+            self.y_left,
+        ) = geometry
+
+        # Draw an oval in the given coordinates
+        if component_selected == "Via":
+            color = "green"
+            w = 3
+            self.canvas.create_oval(
+                x_center, y_center, x_center, y_center, fill=color, width=w, tags=tag_name
+            )
+
+        # Draw the component as an obstacle, and the component pins so they're accessible
+        x_vector = []
+        y_vector = []
+        x_vector.extend(self.pins_x_coordinate)
+        x_vector.extend(self.x_top)
+        x_vector.extend(self.x_bottom)
+        x_vector.extend(self.x_right)
+        x_vector.extend(self.x_left)
+        y_vector.extend(self.pins_y_coordinate)
+        y_vector.extend(self.y_top)
+        y_vector.extend(self.y_bottom)
+        y_vector.extend(self.y_right)
+        y_vector.extend(self.y_left)
+        x_vector = np.round_(x_vector, decimals=2)
+        y_vector = np.round_(y_vector, decimals=2)
+        self.pins.add(component_selected, tag_name, self.pins_x_coordinate, self.pins_y_coordinate)
+
+        if component_selected == "FSR":
+            df = self.component_library(self.filename_pp)
+            for components in df:
+                if components == "FSR":
                     self.canvas.create_oval(
-                        x_vector[i],
-                        y_vector[i],
-                        x_vector[i],
-                        y_vector[i],
-                        fill="black",
+                        self.x_right[0],
+                        self.y_top[0],
+                        self.x_left[0],
+                        self.y_bottom[0],
+                        fill="gray",
                         width=1,
-                        tags=(self.tag_name),
+                        tags=(tag_name),
                     )
-            self.canvas.create_text(self.x, self.y-self.scaling_factor*2, fill="black", font=('Helvetic 5 bold'),text=self.component_selected, tags=(self.tag_name)) #black text above the component
-            self.old_comp = self.component_selected
-            self.comp_selected = 0
+                    self.canvas.create_oval(
+                        self.pins_x_coordinate[0],
+                        self.pins_y_coordinate[0],
+                        self.pins_x_coordinate[0],
+                        y_vector[0],
+                        fill="black",
+                        width=2,
+                        tags=(tag_name),
+                    )
+                    self.canvas.create_oval(
+                        self.pins_x_coordinate[1],
+                        self.pins_y_coordinate[1],
+                        self.pins_x_coordinate[1],
+                        y_vector[1],
+                        fill="black",
+                        width=2,
+                        tags=(tag_name),
+                    )
+        else:
+            for i in range(0, len(x_vector)):
+                self.canvas.create_oval(
+                    x_vector[i],
+                    y_vector[i],
+                    x_vector[i],
+                    y_vector[i],
+                    fill="black",
+                    width=1,
+                    tags=(tag_name),
+                )
+        self.canvas.create_text(x_center, y_center-self.scaling_factor*2, fill="black", font=('Helvetic 5 bold'),text=component_selected, tags=(tag_name)) #black text above the component
 
     #def end_line(self, event):
         """End the current trace."""
@@ -470,6 +1185,8 @@ class TraceMakerApp:
 
     def save(self, event=None):
         """End the trace and then Save the trace coordinates to a CSV file."""
+        if self.loading:
+            return
         self.canvas.old_coords = None
         print(self.coord_x)
         print(self.coord_y)
@@ -479,38 +1196,130 @@ class TraceMakerApp:
         else:
             mode = "a"
 
-        with open(self.filename, mode) as f:
-            writer = csv.writer(f)
-            # Write the data
-            #data = [self.tunnel, self.coord_x[:-1], self.coord_y[:-1], self.tag_line]
-            data = [self.tunnel, self.coord_x, self.coord_y, self.tag_line]
-            print(data)
-            if mode == "w":
-                first_row = ["Tunnel", "X", "Y", "Tag"]
-                writer.writerow(first_row)
-            writer.writerow(data)
+        # A trace needs two points, otherwise tag_line is still the tag of the previous trace
+        if len(self.coord_x) < 2:
+            print("Trace not saved, it has fewer than two points")
+        else:
+            with open(self.filename, mode) as f:
+                writer = csv.writer(f)
+                # Write the data
+                #data = [self.tunnel, self.coord_x[:-1], self.coord_y[:-1], self.tag_line]
+                data = [self.tunnel, self.coord_x, self.coord_y, self.tag_line]
+                print(data)
+                if mode == "w":
+                    first_row = ["Tunnel", "X", "Y", "Tag"]
+                    writer.writerow(first_row)
+                writer.writerow(data)
+            self.watcher.wrote(self.filename, 3, added=[data])
+
+            # Connect the pins clicked along this trace, duplicates are rejected and the file is rewritten compacted
+            for x_pin, y_pin, component, tag, pin_index in self.trace_pins:
+                self.connections.add(x_pin, y_pin, component, tag, pin_index, self.tag_line)
+            self.connections.write(self.filename_pins_selected)
+            self.here = 1
 
         # Reset state variables
+        self.trace_pins = []
         self.coord_x = []
         self.coord_y = []
-        self.here = 1
         self.same_line = 0
 
+    def motion_preview(self, event):
+        """Remember the mouse position and schedule a single preview update for the next frame."""
+        self.preview_xy = (event.x, event.y)
+        if self.preview_pending is None:
+            self.preview_pending = self.root.after(self.preview_frame_ms, self.update_preview)
+
+    def update_preview(self):
+        """Move the preview of the next segment and the pin highlight to the last mouse position."""
+        self.preview_pending = None
+        x, y = self.preview_xy
+        drawing = not self.loading and self.comp_selected == 0 and self.filename is not None
+
+        # Highlight the pin the next click would snap to
+        slot = self.pins.snap(x, y, self.snap_distance) if drawing else None
+        if slot is not None:
+            x, y = self.pins.pin(slot)[:2]
+            r = self.snap_distance + 1
+            self.canvas.coords(self.preview_snap, x - r, y - r, x + r, y + r)
+            self.canvas.itemconfigure(self.preview_snap, state="normal")
+            self.canvas.tag_raise(self.preview_snap)
+        else:
+            self.canvas.itemconfigure(self.preview_snap, state="hidden")
+
+        # Rubber-band segment from the last point of the trace
+        if drawing and self.canvas.old_coords:
+            x1, y1 = self.canvas.old_coords
+            self.canvas.coords(self.preview_line, x1, y1, x, y)
+            if self.preview_style != self.tunnel:
+                self.canvas.itemconfigure(
+                    self.preview_line, fill=self.layers.colors[self.tunnel], width=self.layers.widths[self.tunnel]
+                )
+                self.preview_style = self.tunnel
+            self.canvas.itemconfigure(self.preview_line, state="normal")
+            self.canvas.tag_raise(self.preview_line)
+        else:
+            self.canvas.itemconfigure(self.preview_line, state="hidden")
+
     def via_tunnel(self):
         """Toggle the tunnel mode."""
+        if self.tunnel == 0:
+            self.set_layer(1)
+        else:
+            self.set_layer(0)
+
+    def set_layer(self, layer):
+        """Make a layer the active one, the current trace ends at the layer change."""
         self.canvas.old_coords = None
         self.coord_x = self.coord_x[:-1]
         self.coord_y = self.coord_y[:-1]
+        self.tunnel = layer
 
         if self.tunnel == 0:
-            self.button_via.configure(bg="#bf9000", fg="white")
-            self.tunnel = 1
-        else:
             self.button_via.configure(bg=self.orig_color, fg="black")
+        else:
+            self.button_via.configure(bg=self.layers.colors[self.tunnel], fg="white")
+        self.combo_layer.current(self.tunnel)
+        self.update_layer_button()
+
+    def layer_callback(self, event):
+        """Handle the selection of a layer from the dropdown menu."""
+        self.set_layer(self.combo_layer.current())
+
+    def toggle_layer(self):
+        """Hide or show the active layer with one canvas tag operation."""
+        self.layers.visible[self.tunnel] = not self.layers.visible[self.tunnel]
+        state = "normal" if self.layers.visible[self.tunnel] else "hidden"
+        self.canvas.itemconfigure(self.layers.tag(self.tunnel), state=state)
+        self.update_layer_button()
+
+    def add_layer(self):
+        """Add a layer to the design and make it the active one."""
+        self.layers.ensure(len(self.layers))
+        if self.filename_layers is not None:
+            self.layers.write(self.filename_layers)
+        self.update_layer_list()
+        self.set_layer(len(self.layers) - 1)
+
+    def update_layer_button(self):
+        """Show on the visibility button what pressing it does to the active layer."""
+        if self.layers.visible[self.tunnel]:
+            self.button_layer.configure(text="Hide Layer")
+        else:
+            self.button_layer.configure(text="Show Layer")
+
+    def update_layer_list(self):
+        """Refresh the layer dropdown after the layers of the design changed."""
+        self.combo_layer.configure(values=self.layers.names)
+        if self.tunnel >= len(self.layers):
             self.tunnel = 0
+        self.combo_layer.current(self.tunnel)
+        self.update_layer_button()
 
     def rotate(self, event=None):
         """Rotate the selected component."""
+        if self.loading:
+            return
         self.comp_selected = 1
         self.component_selected = self.combo.get()
 
@@ -521,10 +1330,8 @@ class TraceMakerApp:
         elif self.degree != 0 and self.component_selected != self.old_comp_selected:
             self.degree = math.pi / 2
 
-        # Adjust component and pin lists
-        self.component_here = self.component_here[: len(self.x_pin_points) - len(self.pins_x_coordinate)]
-        self.x_pin_points = self.x_pin_points[: len(self.x_pin_points) - len(self.pins_x_coordinate)]
-        self.y_pin_points = self.y_pin_points[: len(self.y_pin_points) - len(self.pins_x_coordinate)]
+        # Remove the pins of the component being rotated, they are added again when it is redrawn
+        self.pins.remove(self.tag_name)
 
         self.canvas.old_coords = None
         self.coord_x = self.coord_x[:-1]
@@ -545,18 +1352,22 @@ class TraceMakerApp:
         self.old_comp_selected = self.component_selected
         if self.filename_pp_coord is not None:
             try:
-                df = pd.read_csv(self.filename_pp_coord)
+                header, rows = read_csv_rows(self.filename_pp_coord)
                 tolerance = 1e-2
-                row_idx = df[
-                    (df['Component'].str.strip() == self.component_selected.strip()) &
-                    (np.isclose(df['X'], self.x_center, atol=tolerance)) &
-                    (np.isclose(df['Y'], self.y_center, atol=tolerance))
-                ].index
-
-                if not row_idx.empty:
+                row_idx = [
+                    i for i, row in enumerate(rows)
+                    if row[0].strip() == self.component_selected.strip()
+                    and abs(float(row[1]) - self.x_center) <= tolerance
+                    and abs(float(row[2]) - self.y_center) <= tolerance
+                ]
+
+                if row_idx:
                     new_angle = int(self.degree * 180 / math.pi)
-                    df.loc[row_idx, 'Orientation'] = new_angle
-                    df.to_csv(self.filename_pp_coord, index=False)
+                    old_rows = [list(rows[i]) for i in row_idx]
+                    for i in row_idx:
+                        rows[i][3] = new_angle
+                    write_csv_rows(self.filename_pp_coord, header, rows)
+                    self.watcher.wrote(self.filename_pp_coord, 6, added=[rows[i] for i in row_idx], removed=old_rows)
                 else:
                     print("Could not find matching row to update orientation.")
             except Exception as e:
@@ -572,6 +1383,8 @@ class TraceMakerApp:
 
     def delete(self, event=None):
         """Delete lines or components."""
+        if self.loading:
+            return
         self.canvas.old_coords = None
         self.coord_x = self.coord_x[:-1]
         self.coord_y = self.coord_y[:-1]
@@ -579,48 +1392,42 @@ class TraceMakerApp:
         self.y1 = self.coord_y[-1]
 
         # Check for components near the selected point
-        df_pp_comps = pd.read_csv(self.filename_pp_coord)
-        comp_list = df_pp_comps.iloc[:][:]
+        header_comps, comp_list = read_csv_rows(self.filename_pp_coord)
         dist_point_to_component = []
         tag_name_here = None
 
         for i in range(len(comp_list)):
-            x_comp_points = df_pp_comps.iloc[i][1]
-            y_comp_points = df_pp_comps.iloc[i][2]
+            x_comp_points = float(comp_list[i][1])
+            y_comp_points = float(comp_list[i][2])
             dist_point_to_component.append(math.sqrt((x_comp_points - self.x1) ** 2 + (y_comp_points - self.y1) ** 2))
             if min(dist_point_to_component) < 10.0:
                 minpos = dist_point_to_component.index(min(dist_point_to_component))
-                component_delete = df_pp_comps.iloc[i][0]
-                tag_name_here = df_pp_comps.iloc[i][6]
+                component_delete = comp_list[i][0]
+                tag_name_here = comp_list[i][6]
 
                 # Remove component from the CSV file
-                df_pp_comps = df_pp_comps.drop(df_pp_comps.index[i])
-                df_pp_comps.to_csv(self.filename_pp_coord, index=False)
+                removed = comp_list.pop(i)
+                write_csv_rows(self.filename_pp_coord, header_comps, comp_list)
+                self.watcher.wrote(self.filename_pp_coord, 6, removed=[removed])
 
                 # Remove pins related to the deleted component
-                df_pp_pins = pd.read_csv(self.filename_pins_selected)
-                pins_list = df_pp_pins.iloc[:][:]
-                pins_match = []
-                for pins in range(len(pins_list)):
-                    if df_pp_pins.iloc[pins][3] == tag_name_here:
-                        pins_match.append(pins)
-
-                if len(pins_match) != 0:
-                    df_pp_pins = df_pp_pins.drop(df_pp_pins.index[pins_match])
-                    df_pp_pins.to_csv(self.filename_pins_selected, index=False)
+                self.pins.remove(tag_name_here)
+                self.connections.remove(tag=tag_name_here)
+                self.connections.write(self.filename_pins_selected)
                 break
 
         # If no components are near, check for traces
         if tag_name_here is None:
-            df_traces = pd.read_csv(self.filename)
-            traces_list = df_traces.iloc[:][:]
+            header_traces, traces_list = read_csv_rows(self.filename)
             dist_point_to_traces = []
             line_points = 40
             found = 0
 
             for traces in range(len(traces_list)):
-                x = np.fromstring(str(df_traces.iloc[traces][1])[1:-1], sep=",")
-                y = np.fromstring(str(df_traces.iloc[traces][2])[1:-1], sep=",")
+                if not self.layers.visible[self.layers.layer(traces_list[traces][0])]:
+                    continue  # Hidden layers are not hit-tested
+                x = parse_coordinates(traces_list[traces][1])
+                y = parse_coordinates(traces_list[traces][2])
                 for segments in range(len(x) - 1):
                     line_length = math.sqrt((x[segments + 1] - x[segments]) ** 2 + (y[segments + 1] - y[segments]) ** 2)
                     angle_seg = self.calculate_angle(x[segments],y[segments],x[segments+ 1],y[segments + 1])
@@ -637,9 +1444,12 @@ class TraceMakerApp:
                     if min(dist_point_to_traces) < 7.0:
                         minpos = traces
                         found = 1
-                        tag_name_here = df_traces.iloc[traces][3]
-                        df_traces = df_traces.drop(df_traces.index[traces])
-                        df_traces.to_csv(self.filename, index=False)
+                        tag_name_here = traces_list[traces][3]
+                        removed = traces_list.pop(traces)
+                        write_csv_rows(self.filename, header_traces, traces_list)
+                        self.watcher.wrote(self.filename, 3, removed=[removed])
+                        self.connections.remove(trace=tag_name_here)
+                        self.connections.write(self.filename_pins_selected)
                         break
                 if found == 1:
                     break
@@ -652,17 +1462,26 @@ class TraceMakerApp:
         self.coord_y = self.coord_y[:-1]
         
 
-    def load_design(self, event=None):
-        """Load a saved design, including components and traces."""
-        self.canvas.old_coords = None
-        self.load = 1
-        self.tag_line_vector = []
-        self.tag_comp_vector = []
+    def load_design(self, event=None, path=None):
+        """Load a saved design, including components and traces, without blocking the GUI."""
+        if self.loading:
+            return
 
-        # Prompt the user to select a directory
-        path = tkFileDialog.askdirectory()
+        # Prompt the user to select a directory, unless a replayed session gives it
+        if path is None:
+            path = tkFileDialog.askdirectory()
+            if not path:
+                return
         path = os.path.basename(path)
-        print("Path is:", path)
+        print("Path is: {}".format(path))
+        if self.session is not None:
+            self.session.write("load", path)
+
+        self.canvas.old_coords = None
+        self.load = 1
+        self.loading = True
+        self.tag_line_vector = set()
+        self.tag_comp_vector = set()
 
         # Define filenames based on the selected path
         self.filename_pp = "Pick_and_place_components_with_pads.csv"
@@ -670,85 +1489,260 @@ class TraceMakerApp:
         self.filename_pp_coord = "{}/PP_List_Coordinates_{}.csv".format(path, path)
         self.filename_base = "{}/Base_Coordinates_{}.csv".format(path, path)
         self.filename_pins_selected = "{}/Pins_Coordinates_{}.csv".format(path, path)
+        self.filename_layers = "{}/Layers_{}.csv".format(path, path)
+        self.layers = LayerStack.read(self.filename_layers)
+        self.update_layer_list()
+
+        self.connections = PinConnections()
+        self.trace_pins = []
+        self.load_queue = Queue.Queue()
+        self.load_cancel = threading.Event()
+        self.load_total = 0
+        self.load_done = 0
+        self.line_tag = 0
 
-        # Load base coordinates
-        origin_x = 2
-        origin_y = 2
-        df_PP_base = pd.read_csv(self.filename_base)
-        x_base_array = np.fromstring(str(df_PP_base.iloc[0][0])[1:-1], sep=",")
-        y_base_array = np.fromstring(str(df_PP_base.iloc[0][1])[1:-1], sep=",")
-        self.x_border = x_base_array[1] - x_base_array[0]
-        self.y_border = y_base_array[1] - y_base_array[0]
-
-        # Load and draw components
-        df_PP_Coord = pd.read_csv(self.filename_pp_coord)
-        PP_list_len = df_PP_Coord.iloc[:][:]
-        print(df_PP_Coord)
-
-        for comps in range(len(PP_list_len)):
-            self.component_selected = df_PP_Coord.iloc[comps][0]
-            self.x = df_PP_Coord.iloc[comps][1]
-            self.y = df_PP_Coord.iloc[comps][2]
-            self.degree = df_PP_Coord.iloc[comps][3]
-            self.tag_comp = df_PP_Coord.iloc[comps][6]
-            self.tag_comp_vector.append(self.tag_comp)
-            self.comp_selected = 1
-            self.here_comp = 1
-            self.draw_line(None)
+        self.progress_load["value"] = 0
+        self.button_cancel_load.configure(state="normal")
 
-        # Load and draw traces
-        self.comp_selected = 0
-        df_PP_Traces = pd.read_csv(self.filename, index_col=False)
-        print(df_PP_Traces)
-        Traces_list_len = df_PP_Traces.iloc[:][:]
-        self.line_tag = 0
+        # Parsing and geometry run in a worker thread, canvas items are inserted in chunks by load_design_step
+        worker = threading.Thread(
+            target=self.load_design_worker,
+            args=(
+                self.filename_pp, self.filename_base, self.filename_pp_coord, self.filename, self.filename_pins_selected,
+                self.load_queue, self.load_cancel,
+            ),
+        )
+        worker.daemon = True
+        worker.start()
+        self.root.after(self.load_poll_ms, self.load_design_step)
+
+    def load_design_worker(self, filename_pp, filename_base, filename_pp_coord, filename_traces, filename_pins, out_queue, cancel):
+        """Parse the design files and compute component geometry off the Tk thread."""
+        try:
+            # Load base coordinates
+            x_base_array, y_base_array = read_base(filename_base)
+
+            header, df_PP_Coord = read_csv_rows(filename_pp_coord)
+            header, df_PP_Traces = read_csv_rows(filename_traces)
+            header, pin_rows = read_csv_rows(filename_pins) if os.path.exists(filename_pins) else ([], [])
+            out_queue.put(("total", len(df_PP_Coord) + len(df_PP_Traces) + len(pin_rows)))
+            out_queue.put(("base", x_base_array[1] - x_base_array[0], y_base_array[1] - y_base_array[0]))
+
+            # Components: geometry is computed here, drawing happens on the Tk thread
+            num_points = 20
+            for comps in range(len(df_PP_Coord)):
+                if cancel.is_set():
+                    return
+                component = df_PP_Coord[comps][0]
+                x = to_number(df_PP_Coord[comps][1])
+                y = to_number(df_PP_Coord[comps][2])
+                degree = to_number(df_PP_Coord[comps][3])
+                tag_comp = df_PP_Coord[comps][6]
+                theta = (degree / 180.0) * math.pi
+                geometry = self.tracer_coordinates(filename_pp, x, y, num_points, component, theta)
+                out_queue.put(("component", component, x, y, degree, tag_comp, geometry))
+
+            # Traces
+            for traces in range(len(df_PP_Traces)):
+                if cancel.is_set():
+                    return
+                x = parse_coordinates(df_PP_Traces[traces][1])
+                y = parse_coordinates(df_PP_Traces[traces][2])
+                out_queue.put(("trace", to_number(df_PP_Traces[traces][0]), x, y, df_PP_Traces[traces][3]))
+
+            # Pin connections, resolved once all the components and traces are drawn
+            for row in pin_rows:
+                if cancel.is_set():
+                    return
+                out_queue.put(("pin", row))
+        except Exception as e:
+            out_queue.put(("error", e))
+            return
+        out_queue.put(("done",))
 
-        for traces in range(len(Traces_list_len)):
-            x = np.fromstring(str(df_PP_Traces.iloc[traces][1])[1:-1], sep=",")
-            y = np.fromstring(str(df_PP_Traces.iloc[traces][2])[1:-1], sep=",")
-            len_x = len(x)
-            self.line_tag += 1
-
-            for segments in range(len_x - 1):
-                x1 = x[segments]
-                y1 = y[segments]
-                x2 = x[segments + 1]
-                y2 = y[segments + 1]
-                self.tag_line = df_PP_Traces.iloc[traces][3]
-                self.tag_line_vector.append(self.tag_line)
-
-                if df_PP_Traces.iloc[traces][0] == 1:
-                    color_line = "#bf9000"  # Tunnel color
-                    self.canvas.create_line(
-                        x1, y1, x2, y2, width=3, fill=color_line, tags=(self.tag_line)
-                    )
-                else:
-                    color_line = "gray50"
-                    self.canvas.create_line(
-                        x1, y1, x2, y2, width=1, fill=color_line, tags=(self.tag_line)
-                    )
+    def load_design_step(self):
+        """Insert the next chunk of loaded items on the canvas, then yield back to the event loop."""
+        if self.load_cancel.is_set():
+            self.finish_load_design(cancelled=True)
+            return
 
-                # Add the missing section here
-                if segments == len_x - 2:
-                    x = np.fromstring(str(df_PP_Traces.iloc[traces][1])[1:-1], sep=",")
-                    y = np.fromstring(str(df_PP_Traces.iloc[traces][2])[1:-1], sep=",")
-                    x1 = x[segments + 1]
-                    y1 = y[segments + 1]
-                    self.draw_line(None)
+        # Draw until the frame budget runs out, so the window keeps repainting and handling clicks
+        start = time.time()
+        while time.time() - start < self.load_frame_budget:
+            try:
+                item = self.load_queue.get_nowait()
+            except Queue.Empty:
+                break
 
-        # Draw the workspace boundary
-        self.canvas.create_line(origin_x, origin_y, self.x_border, origin_y, fill="black", width=1)
-        self.canvas.create_line(self.x_border, origin_y, self.x_border, self.y_border, fill="black", width=1)
-        self.canvas.create_line(self.x_border, self.y_border, origin_x, self.y_border, fill="black", width=1)
-        self.canvas.create_line(origin_x, self.y_border, origin_x, origin_y, fill="black", width=1)
+            kind = item[0]
+            if kind == "total":
+                self.load_total = item[1]
+                self.progress_load.configure(maximum=max(self.load_total, 1))
+            elif kind == "base":
+                self.x_border, self.y_border = item[1], item[2]
+            elif kind == "component":
+                self.load_component(*item[1:])
+                self.load_done += 1
+            elif kind == "trace":
+                self.load_trace(*item[1:])
+                self.load_done += 1
+            elif kind == "pin":
+                self.connections.add_row(item[1], self.pins)
+                self.load_done += 1
+            elif kind == "error":
+                print("Error loading design: {}".format(item[1]))
+                self.finish_load_design(cancelled=True)
+                return
+            elif kind == "done":
+                self.finish_load_design(cancelled=False)
+                return
+
+        self.progress_load["value"] = self.load_done
+        self.root.after(self.load_poll_ms, self.load_design_step)
+
+    def load_component(self, component, x, y, degree, tag_comp, geometry):
+        """Draw one component parsed by the load worker."""
+        if geometry is None:
+            return
+        self.component_selected = component
+        self.x = x
+        self.y = y
+        self.degree = (degree / 180.0) * math.pi
+        self.tag_comp = tag_comp
+        self.tag_name = tag_comp
+        self.tag_comp_vector.add(tag_comp)
+        self.x_center = x
+        self.y_center = y
+        self.here_comp = 1
+        self.draw_component(component, tag_comp, x, y, geometry)
+        self.old_comp = component
+        self.comp_selected = 0
+
+    def load_trace(self, tunnel, x, y, tag_line):
+        """Draw one trace parsed by the load worker."""
+        self.line_tag += 1
+        self.tag_line = tag_line
+        self.draw_trace(tunnel, x, y, tag_line)
+
+    def draw_trace(self, tunnel, x, y, tag_line):
+        """Draw a saved trace on its layer and connect it to the pins it goes through."""
+        self.tag_line_vector.add(tag_line)
+        layer = self.layers.layer(tunnel)
+        self.layers.ensure(layer)
+        options = self.layers.line_options(layer)
+        for segments in range(len(x) - 1):
+            self.canvas.create_line(
+                x[segments], y[segments], x[segments + 1], y[segments + 1], tags=(tag_line, self.layers.tag(layer)), **options
+            )
+
+        # Register the pin connections of the trace, replaying a saved trace adds no duplicates
+        self.connections.add_trace(x, y, tag_line, self.pins)
+
+    def finish_load_design(self, cancelled):
+        """Draw the workspace boundary, or roll back a cancelled load, and reset the state variables."""
+        if cancelled:
+            self.load_cancel.set()
+            for tag in self.tag_comp_vector | self.tag_line_vector:
+                self.canvas.delete(tag)
+            for tag in self.tag_comp_vector:
+                self.pins.remove(tag)
+            self.connections = PinConnections()
+            self.tag_line_vector = set()
+            self.tag_comp_vector = set()
+            self.filename = None
+            self.filename_pp_coord = None
+            self.filename_base = None
+            self.filename_pins_selected = None
+            self.filename_layers = None
+            print("Load cancelled")
+        else:
+            # Draw the workspace boundary
+            origin_x = 2
+            origin_y = 2
+            self.canvas.create_line(origin_x, origin_y, self.x_border, origin_y, fill="black", width=1)
+            self.canvas.create_line(self.x_border, origin_y, self.x_border, self.y_border, fill="black", width=1)
+            self.canvas.create_line(self.x_border, self.y_border, origin_x, self.y_border, fill="black", width=1)
+            self.canvas.create_line(origin_x, self.y_border, origin_x, origin_y, fill="black", width=1)
+            self.progress_load["value"] = self.load_total
+            self.update_layer_list()  # Traces may use more layers than the layers file defines
+            self.watch_design_files()
 
         # Reset state variables
         self.load = 0
+        self.loading = False
+        self.button_cancel_load.configure(state="disabled")
         self.canvas.old_coords = None
         self.here = 1
         self.coord_x = []
         self.coord_y = []
 
+    def cancel_load(self):
+        """Cancel a design load in progress."""
+        if self.loading:
+            if self.session is not None:
+                self.session.write("cancel")
+            self.load_cancel.set()
+
+    def watch_design_files(self):
+        """Take the design files as drawn and start checking them for edits made outside the GUI."""
+        self.watcher = DesignWatcher()
+        self.watcher.changes(self.filename_pp_coord, 6)
+        self.watcher.changes(self.filename, 3)
+        if self.watch_pending is None:
+            self.watch_pending = self.root.after(self.watch_ms, self.poll_design_files)
+
+    def poll_design_files(self):
+        """Redraw the components and traces edited outside the GUI since the last check."""
+        self.watch_pending = self.root.after(self.watch_ms, self.poll_design_files)
+        if self.filename is None or self.loading or self.canvas.old_coords is not None:
+            return  # Edits are applied once the load or the trace being drawn is finished
+
+        version = self.connections.version
+        component_changes = self.watcher.changes(self.filename_pp_coord, 6)
+        if component_changes is not None:
+            added, removed, changed = component_changes
+            # Traces connected to a changed component, matched again to its pins once it is redrawn
+            connected = set(key[2] for tag, rows in changed for key in self.connections.by_tag.get(tag, ()))
+            for tag in removed + [tag for tag, rows in changed]:
+                self.remove_component(tag)
+            for tag, rows in added + changed:
+                for row in rows:
+                    x, y, degree = float(row[1]), float(row[2]), float(row[3])
+                    geometry = self.tracer_coordinates(self.filename_pp, x, y, 20, row[0], math.radians(degree))
+                    if geometry is not None:
+                        self.tag_comp_vector.add(tag)
+                        self.draw_component(row[0], tag, x, y, geometry)
+            for trace in connected:
+                for row in self.watcher.rows(self.filename, trace):
+                    self.connections.add_trace(row[1], row[2], trace, self.pins)
+            print("Components reloaded: {} added, {} removed, {} changed".format(len(added), len(removed), len(changed)))
+
+        trace_changes = self.watcher.changes(self.filename, 3)
+        if trace_changes is not None:
+            added, removed, changed = trace_changes
+            for tag in removed + [tag for tag, rows in changed]:
+                self.remove_trace(tag)
+            for tag, rows in added + changed:
+                for row in rows:
+                    self.draw_trace(row[0], parse_coordinates(row[1]), parse_coordinates(row[2]), tag)
+            self.update_layer_list()
+            print("Traces reloaded: {} added, {} removed, {} changed".format(len(added), len(removed), len(changed)))
+        if self.connections.version != version:
+            self.connections.write(self.filename_pins_selected)
+
+    def remove_component(self, tag):
+        """Remove a component from the canvas, the pins and the pin connections."""
+        self.canvas.delete(tag)
+        self.pins.remove(tag)
+        self.connections.remove(tag=tag)
+        self.tag_comp_vector.discard(tag)
+
+    def remove_trace(self, tag):
+        """Remove a trace from the canvas and the pin connections."""
+        self.canvas.delete(tag)
+        self.connections.remove(trace=tag)
+        self.tag_line_vector.discard(tag)
+
         # Simulate selecting the component in the dropdown menu
     
     def simulate_scroll_and_select(self, target_component, delay, idx):
@@ -771,8 +1765,8 @@ class TraceMakerApp:
 
     def entry_callback(self, event):
         """Handle the creation of a new design folder and initialize files."""
-        self.tag_line_vector = []
-        self.tag_comp_vector = []
+        self.tag_line_vector = set()
+        self.tag_comp_vector = set()
         self.name_folder = self.entry.get()
         path = "./{}".format(self.name_folder)
         os.mkdir(path)
@@ -784,6 +1778,7 @@ class TraceMakerApp:
         self.filename_pp_coord = "{}/PP_List_Coordinates_{}.csv".format(path, self.name_folder)
         self.filename_base = "{}/Base_Coordinates_{}.csv".format(path, self.name_folder)
         self.filename_pins_selected = "{}/Pins_Coordinates_{}.csv".format(path, self.name_folder)
+        self.filename_layers = "{}/Layers_{}.csv".format(path, self.name_folder)
 
         # Draw workspace boundary
         self.canvas.create_line(self.origin_x, self.origin_y, self.x_border, self.origin_y, fill="black", width=1)
@@ -812,156 +1807,28 @@ class TraceMakerApp:
             writer.writerow(first_row)
 
         # Create pin file
-        with open(self.filename_pins_selected, "w") as f:
-            writer = csv.writer(f)
-            first_row = ["X", "Y", "Component", "Tag"]
-            writer.writerow(first_row)
+        self.connections = PinConnections()
+        self.trace_pins = []
+        self.connections.write(self.filename_pins_selected)
+
+        # Create layers file
+        self.layers = LayerStack()
+        self.layers.write(self.filename_layers)
+        self.update_layer_list()
 
         self.canvas.old_coords = None
         self.coord_x = []
         self.coord_y = []
+        self.watch_design_files()
 
     def tracer_coordinates(self, filename_pp, x_center, y_center, num_points, component_selected, theta):
-        """Calculate the coordinates for the selected component."""
-        df = pd.read_csv(filename_pp)
-        width_ind = 1  # Index for the width of the component
-        length_ind = 2  # Index for the length of the component
-        pins_ind = 7  # Index for the number of pins
-        conn_lead_ind = 8  # Ignore for now
-        coordinate_x_ind = 9  # Index for the first x-coordinate of pin #1
-        offset_usb = -1  # Offset needed for USB components
-        rot_mat = [[math.cos(theta), -1 * math.sin(theta)], [math.sin(theta), math.cos(theta)]]
-
-        # Find the selected component in the CSV file
-        for i in range(len(df)):
-            if component_selected == df.iloc[i][0]:
-                component_from_list = i
-                break
+        """Calculate the coordinates for the selected component from its cached footprint template."""
         if component_selected != "FSR Place":
-            num_pins = int(df.iloc[component_from_list][pins_ind])
-            coordinate_y_ind = coordinate_x_ind + num_pins
-
-            # Calculate rotated pin coordinates
-            pins_x_coordinate_rotation = []
-            pins_y_coordinate_rotation = []
-            for val in range(num_pins):
-                x = np.array(df.iloc[component_from_list][coordinate_x_ind + val])
-                y = np.array(df.iloc[component_from_list][coordinate_y_ind + val])
-                pins_x_coordinate_rotation.append(
-                    x_center + self.scaling_factor * (x * math.cos(theta) - y * math.sin(theta))
-                )
-                pins_y_coordinate_rotation.append(
-                    y_center - self.scaling_factor * (x * math.sin(theta) + y * math.cos(theta))
-                )
-
-            pins_x_coordinate = pins_x_coordinate_rotation
-            pins_y_coordinate = pins_y_coordinate_rotation
-
-            if component_selected == 'USB':
-                pins_y_coordinate = [y + offset_usb for y in pins_y_coordinate]
+            return place_footprint(filename_pp, x_center, y_center, num_points, component_selected, theta, self.scaling_factor)
 
-            # Define the perimeter as an obstacle
-            x_top, y_top = self.calculate_perimeter_top(df, component_from_list, x_center, y_center, theta, num_points)
-            x_right, y_right = self.calculate_perimeter_right(df, component_from_list, x_center, y_center, theta, num_points)
-            x_bottom, y_bottom = self.calculate_perimeter_bottom(df, component_from_list, x_center, y_center, theta, num_points)
-            x_left, y_left = self.calculate_perimeter_left(df, component_from_list, x_center, y_center, theta, num_points)
-
-            # Adjust pin connections based on overlap
-            pins_x_coordinate, pins_y_coordinate = self.adjust_pins(
-                pins_x_coordinate, pins_y_coordinate, df, component_from_list, x_top, y_top, x_bottom, y_bottom, x_right, y_right, x_left, y_left
-            )
-
-            return pins_x_coordinate, pins_y_coordinate, x_top, y_top, x_bottom, y_bottom, x_right, y_right, x_left, y_left
-
-    def calculate_perimeter_top(self, df, component_from_list, x_center, y_center, theta, num_points):
-        """Calculate the top perimeter of the component."""
-        y_top = y_center + self.scaling_factor * df.iloc[component_from_list][2] / 2
-        y_top = y_top * np.ones(num_points)
-        x_top = np.linspace(
-            x_center - self.scaling_factor * df.iloc[component_from_list][1] / 2,
-            x_center + self.scaling_factor * df.iloc[component_from_list][1] / 2,
-            num_points
-        )
-        if len(x_top) > len(y_top):
-            x_top = x_top[:-1]
-        x_top, y_top = self.rotate_coordinates(x_top, y_top, x_center, y_center, theta)
-        return x_top, y_top
-
-    def calculate_perimeter_right(self, df, component_from_list, x_center, y_center, theta, num_points):
-        """Calculate the right perimeter of the component."""
-        y_right = np.linspace(
-            y_center - self.scaling_factor * df.iloc[component_from_list][2] / 2,
-            y_center + self.scaling_factor * df.iloc[component_from_list][2] / 2,
-            num_points
-        )
-        x_right = x_center + self.scaling_factor * df.iloc[component_from_list][1] / 2
-        x_right = x_right * np.ones(num_points)
-        x_right, y_right = self.rotate_coordinates(x_right, y_right, x_center, y_center, theta)
-        return x_right, y_right
-
-    def calculate_perimeter_bottom(self, df, component_from_list, x_center, y_center, theta, num_points):
-        """Calculate the bottom perimeter of the component."""
-        y_bottom = y_center - self.scaling_factor * df.iloc[component_from_list][2] / 2
-        y_bottom = y_bottom * np.ones(num_points)
-        x_bottom = np.linspace(
-            x_center - self.scaling_factor * df.iloc[component_from_list][1] / 2,
-            x_center + self.scaling_factor * df.iloc[component_from_list][1] / 2,
-            num_points
-        )
-        if len(x_bottom) > len(y_bottom):
-            x_bottom = x_bottom[:-1]
-        x_bottom, y_bottom = self.rotate_coordinates(x_bottom, y_bottom, x_center, y_center, theta)
-        return x_bottom, y_bottom
-
-    def calculate_perimeter_left(self, df, component_from_list, x_center, y_center, theta, num_points):
-        """Calculate the left perimeter of the component."""
-        y_left = np.linspace(
-            y_center - self.scaling_factor * df.iloc[component_from_list][2] / 2,
-            y_center + self.scaling_factor * df.iloc[component_from_list][2] / 2,
-            num_points
-        )
-        x_left = x_center - self.scaling_factor * df.iloc[component_from_list][1] / 2
-        x_left = x_left * np.ones(num_points)
-        x_left, y_left = self.rotate_coordinates(x_left, y_left, x_center, y_center, theta)
-        return x_left, y_left
-
-    def rotate_coordinates(self, x_coords, y_coords, x_center, y_center, theta):
-        """Rotate coordinates around a center point."""
-        x_rotated, y_rotated = [], []
-        for x, y in zip(x_coords, y_coords):
-            x_rotated.append(x_center + (x - x_center) * math.cos(theta) - (y - y_center) * math.sin(theta))
-            y_rotated.append(y_center + (x - x_center) * math.sin(theta) + (y - y_center) * math.cos(theta))
-        return x_rotated, y_rotated
-
-    def adjust_pins(self, pins_x_coordinate, pins_y_coordinate, df, component_from_list, x_top, y_top, x_bottom, y_bottom, x_right, y_right, x_left, y_left):
-        """Adjust pin coordinates based on overlap with borders."""
-        conn_lead_ind = 8  # Index for connection lead length in the CSV file
-        scaling_factor = self.scaling_factor
-
-        # Determine the borders of the component
-        x_borders = [x_top[0], x_bottom[0], x_right[0], x_left[0]]
-        y_borders = [y_top[0], y_bottom[0], y_right[0], y_left[0]]
-        right_border_x = max(x_borders)
-        left_border_x = min(x_borders)
-        top_border_y = max(y_borders)
-        bottom_border_y = min(y_borders)
-
-        # Adjust pin coordinates based on their position relative to the borders
-        for pins_total in range(len(pins_x_coordinate)):
-            if pins_x_coordinate[pins_total] >= right_border_x:
-                # Pin is on the right border
-                pins_x_coordinate[pins_total] -= df.iloc[component_from_list][conn_lead_ind] * scaling_factor
-            elif pins_x_coordinate[pins_total] <= left_border_x:
-                # Pin is on the left border
-                pins_x_coordinate[pins_total] += df.iloc[component_from_list][conn_lead_ind] * scaling_factor
-            elif pins_y_coordinate[pins_total] >= top_border_y:
-                # Pin is on the top border
-                pins_y_coordinate[pins_total] -= df.iloc[component_from_list][conn_lead_ind] * scaling_factor
-            elif pins_y_coordinate[pins_total] <= bottom_border_y:
-                # Pin is on the bottom border
-                pins_y_coordinate[pins_total] += df.iloc[component_from_list][conn_lead_ind] * scaling_factor
-
-        return pins_x_coordinate, pins_y_coordinate
+    def component_library(self, filename_pp):
+        """Return the component library rows indexed by component name."""
+        return footprints.library(filename_pp)
 
     def FSR_placement(self, x, y, scaling_factor):
         """Place FSR sensors in a grid pattern."""
@@ -1018,6 +1885,106 @@ class TraceMakerApp:
         dy = y - tip_y
         self.canvas.move(self.cursor, dx, dy)
 
+    def replay(self, events, headless=False):
+        """Feed the actions of a recorded session back through the handlers.
+
+        At recorded speed the cursor moves to every click and the components are scrolled to in
+        the dropdown menu. Headless, the actions run back to back without animation and the
+        GUI closes at the end, printing the replay time.
+        """
+        start = time.time()
+        if headless:
+            self.load_poll_ms = 0
+            self.load_frame_budget = 1.0
+            for index, (time_ms, action, values) in enumerate(events):
+                self.replay_action(action, values, False)
+                while self.loading and not self.replay_cancels(events, index + 1):
+                    self.root.update()
+            print("Replayed {} actions in {:.3f} s".format(len(events), time.time() - start))
+            self.root.destroy()
+            return
+
+        x, y = self.last_cursor_x, self.last_cursor_y
+        self.cursor = self.canvas.create_polygon(
+            x, y, x, y + 16, x + 4, y + 12, x + 8, y + 19, x + 10, y + 18, x + 6, y + 11, x + 12, y + 11,
+            fill="black", outline="white",
+        )
+        self.root.after_idle(self.replay_step, events, 0)
+
+    def replay_step(self, events, index):
+        """Run one action of a replay at recorded speed and schedule the next one."""
+        if self.loading and not self.replay_cancels(events, index):
+            self.root.after(self.load_poll_ms, self.replay_step, events, index)
+            return
+        if index == len(events):
+            print("Replay finished")
+            return
+        time_ms, action, values = events[index]
+        busy = self.replay_action(action, values, True)
+        if self.replay_cancels(events, index + 1):
+            delay = busy  # Cancel before the replayed load can finish, the recorded one did not
+        elif index + 1 < len(events):
+            delay = max(events[index + 1][0] - time_ms, busy)
+        else:
+            delay = busy
+        self.root.after(delay, self.replay_step, events, index + 1)
+
+    def replay_cancels(self, events, index):
+        """Return True if the action at index cancels the load in progress."""
+        return index < len(events) and events[index][1] == "cancel"
+
+    def replay_action(self, action, values, animate):
+        """Run a recorded action, return how many milliseconds its animation still needs."""
+        if action == "click":
+            x, y = int(values[0]), int(values[1])
+            if not animate:
+                self.draw_line(FakeEvent(x, y))
+                return 0
+            duration = 300
+            self.move_cursor(x, y, duration)
+            self.root.after(duration, self.draw_line, FakeEvent(x, y))
+            return duration + 20
+        if action == "select":
+            if not animate:
+                self.combo.set(values[0])
+                self.combo_callback(None)
+                return 0
+            delay = 40
+            self.simulate_scroll_and_select(values[0], delay, 0)
+            return delay * (list(self.combo["values"]).index(values[0]) + 1)
+        if action == "layer":
+            self.combo_layer.current(int(values[0]))
+            self.layer_callback(None)
+        elif action == "new":
+            self.entry.delete(0, "end")
+            self.entry.insert(0, values[0])
+            self.entry_callback(None)
+        elif action == "load":
+            self.load_design(path=values[0])
+        elif action == "cancel":
+            self.cancel_load()
+        elif action == "save":
+            self.save()
+        elif action == "tunnel":
+            self.via_tunnel()
+        elif action == "rotate":
+            self.rotate()
+        elif action == "delete":
+            self.delete()
+        elif action == "toggle_layer":
+            self.toggle_layer()
+        elif action == "add_layer":
+            self.add_layer()
+        return 0
+
+    def report_first_frame(self):
+        """Print the time from launch to the first interactive frame, then close the GUI (startup benchmark)."""
+        self.root.update()
+        print("First interactive frame: {:.3f} s (pandas imported: {}, PIL imported: {})".format(
+            time.time() - START_TIME, "pandas" in sys.modules, "PIL" in sys.modules))
+        sys.stdout.flush()
+        self.root.destroy()
+
     def calculate_angle(self,x1, y1, x2, y2):
         # Calculate the difference in x and y coordinates
         offset_value = 0.000001
@@ -1032,12 +1999,1517 @@ class TraceMakerApp:
 
 
 class FakeEvent(object):
+    """Mouse event handed to draw_line by a replay."""
+
     def __init__(self, x, y):
         self.x = x
         self.y = y
 
 
+# Batch tools, run from the command line without opening the GUI
+
+
+def read_base(filename_base):
+    """Return the x and y limits of the substrate saved in a Base_Coordinates file."""
+    header, base_rows = read_csv_rows(filename_base)
+    return parse_coordinates(base_rows[0][0]), parse_coordinates(base_rows[0][1])
+
+
+def perimeter_corners(geometry):
+    """Return the four perimeter corners of a placed component as saved in the PP_List_Coordinates file."""
+    x_top, y_top, x_bottom, y_bottom = geometry[2], geometry[3], geometry[4], geometry[5]
+    x_perimeter = [round(float(value), 2) for value in (x_top[0], x_top[-1], x_bottom[-1], x_bottom[0])]
+    y_perimeter = [round(float(value), 2) for value in (y_top[0], y_top[-1], y_bottom[-1], y_bottom[0])]
+    return x_perimeter, y_perimeter
+
+
+class AutoPlacer(object):
+    """Simulated-annealing placement of library components inside the substrate boundary.
+
+    The cost is the Manhattan wirelength of the requested pin-to-pin connections plus a heavy
+    penalty on the overlap of the component outlines (grown by a clearance). Components move,
+    rotate by 90 degrees or swap places. Only the cost terms of the moved components are
+    evaluated, as numpy operations over all the other components and their connections.
+    """
+
+    angles = [0, 90, 180, 270]
+
+    def __init__(self, components, connections, x_base, y_base, filename_pp, scaling_factor=SCALING_FACTOR, clearance=1.0, overlap_weight=10.0):
+        self.components = components
+        self.x_limits = (float(x_base[0]), float(x_base[1]))
+        self.y_limits = (float(y_base[0]), float(y_base[1]))
+        self.overlap_weight = overlap_weight
+        clearance = clearance * scaling_factor / 2.0  # Each outline is grown by half the clearance
+
+        # Half sizes of every outline and pin offsets for each of the four rotations
+        count = len(components)
+        self.half_x = np.zeros((count, 4))
+        self.half_y = np.zeros((count, 4))
+        pin_offsets = []
+        for part, component in enumerate(components):
+            offsets = []
+            for rotation, angle in enumerate(self.angles):
+                template = footprints.template(filename_pp, component, math.radians(angle), 20, scaling_factor)
+                self.half_x[part, rotation] = max(np.abs(values).max() for values in template[2::2]) + clearance
+                self.half_y[part, rotation] = max(np.abs(values).max() for values in template[3::2]) + clearance
+                offsets.append(np.column_stack((template[0], template[1])))
+            pin_offsets.append(offsets)
+
+        # Connections as arrays: part and pin offset (per rotation) of both ends
+        self.part_a = np.array([connection[0] for connection in connections], dtype=int)
+        self.part_b = np.array([connection[2] for connection in connections], dtype=int)
+        self.offset_a = np.zeros((len(connections), 4, 2))
+        self.offset_b = np.zeros((len(connections), 4, 2))
+        for index, (part_a, pin_a, part_b, pin_b) in enumerate(connections):
+            for rotation in range(4):
+                self.offset_a[index, rotation] = pin_offsets[part_a][rotation][pin_a]
+                self.offset_b[index, rotation] = pin_offsets[part_b][rotation][pin_b]
+        self.connections_of = [
+            np.flatnonzero((self.part_a == part) | (self.part_b == part)) for part in range(count)
+        ]
+
+    def wirelength(self, positions, rotations, connections):
+        """Return the Manhattan length of a set of connections."""
+        if len(connections) == 0:
+            return 0.0
+        part_a = self.part_a[connections]
+        part_b = self.part_b[connections]
+        pins_a = positions[part_a] + self.offset_a[connections, rotations[part_a]]
+        pins_b = positions[part_b] + self.offset_b[connections, rotations[part_b]]
+        return np.abs(pins_a - pins_b).sum()
+
+    def overlap(self, positions, rotations, part):
+        """Return the overlap area between one component outline and every other one."""
+        parts = np.arange(len(positions))
+        half_x = self.half_x[parts, rotations]
+        half_y = self.half_y[parts, rotations]
+        overlap_x = np.maximum(0.0, half_x[part] + half_x - np.abs(positions[part, 0] - positions[:, 0]))
+        overlap_y = np.maximum(0.0, half_y[part] + half_y - np.abs(positions[part, 1] - positions[:, 1]))
+        areas = overlap_x * overlap_y
+        areas[part] = 0.0
+        return areas
+
+    def local_cost(self, positions, rotations, parts):
+        """Return the cost terms that involve one or two components."""
+        overlap = 0.0
+        for part in parts:
+            overlap += self.overlap(positions, rotations, part).sum()
+        if len(parts) == 2:
+            overlap -= self.overlap(positions, rotations, parts[0])[parts[1]]  # Counted once per component
+        connections = np.unique(np.concatenate([self.connections_of[part] for part in parts]))
+        return self.wirelength(positions, rotations, connections) + self.overlap_weight * overlap
+
+    def total_cost(self, positions, rotations):
+        """Return the wirelength and the total overlap area of a placement."""
+        overlap = sum(self.overlap(positions, rotations, part).sum() for part in range(len(positions))) / 2.0
+        return self.wirelength(positions, rotations, np.arange(len(self.part_a))), overlap
+
+    def clamp(self, positions, rotations, part):
+        """Keep a component outline inside the substrate boundary."""
+        half_x = self.half_x[part, rotations[part]]
+        half_y = self.half_y[part, rotations[part]]
+        positions[part, 0] = min(max(positions[part, 0], self.x_limits[0] + half_x), self.x_limits[1] - half_x)
+        positions[part, 1] = min(max(positions[part, 1], self.y_limits[0] + half_y), self.y_limits[1] - half_y)
+
+    def move(self, positions, rotations, random, step):
+        """Apply a random move in place and return the components it changed."""
+        part = random.randint(len(positions))
+        choice = random.rand()
+        if choice < 0.7:
+            positions[part] += random.normal(0.0, step, 2)
+            parts = [part]
+        elif choice < 0.9:
+            rotations[part] = (rotations[part] + 1) % 4
+            parts = [part]
+        else:
+            other = random.randint(len(positions))
+            if other == part:
+                return [part]
+            positions[[part, other]] = positions[[other, part]]
+            parts = [part, other]
+        for changed in parts:
+            self.clamp(positions, rotations, changed)
+        return parts
+
+    def anneal(self, seed, iterations):
+        """Run one annealing from a random placement, return the cost, positions and rotations."""
+        random = np.random.RandomState(seed)
+        count = len(self.components)
+        width = self.x_limits[1] - self.x_limits[0]
+        height = self.y_limits[1] - self.y_limits[0]
+        positions = np.column_stack((
+            random.uniform(self.x_limits[0], self.x_limits[1], count),
+            random.uniform(self.y_limits[0], self.y_limits[1], count),
+        ))
+        rotations = random.randint(4, size=count)
+        for part in range(count):
+            self.clamp(positions, rotations, part)
+
+        # Initial temperature from the mean cost change of random moves
+        deltas = []
+        for sample in range(100):
+            trial_positions, trial_rotations = positions.copy(), rotations.copy()
+            parts = self.move(trial_positions, trial_rotations, random, 0.25 * max(width, height))
+            deltas.append(abs(
+                self.local_cost(trial_positions, trial_rotations, parts) - self.local_cost(positions, rotations, parts)
+            ))
+        temperature = max(np.mean(deltas), 1e-6)
+        cooling = (1e-3) ** (1.0 / max(iterations, 1))
+
+        best = (sum(self.total_cost(positions, rotations)), positions.copy(), rotations.copy())
+        for iteration in range(iterations):
+            step = max(1.0, 0.25 * max(width, height) * (1.0 - float(iteration) / iterations))
+            trial_positions, trial_rotations = positions.copy(), rotations.copy()
+            parts = self.move(trial_positions, trial_rotations, random, step)
+            delta = self.local_cost(trial_positions, trial_rotations, parts) - self.local_cost(positions, rotations, parts)
+            if delta <= 0 or random.rand() < math.exp(-delta / temperature):
+                positions, rotations = trial_positions, trial_rotations
+            temperature *= cooling
+            if iteration % 1000 == 999:
+                cost = sum(self.total_cost(positions, rotations))
+                if cost < best[0]:
+                    best = (cost, positions.copy(), rotations.copy())
+
+        cost = sum(self.total_cost(positions, rotations))
+        if cost < best[0]:
+            best = (cost, positions, rotations)
+        return best
+
+
+def run_annealing(arguments):
+    """Process pool entry point, run one independent annealing restart."""
+    placer, seed, iterations = arguments
+    return placer.anneal(seed, iterations)
+
+
+def auto_place(path, parts_file, connections_file=None, restarts=4, iterations=20000, force=False,
+               filename_pp="Pick_and_place_components_with_pads.csv", scaling_factor=SCALING_FACTOR):
+    """Place the parts of parts_file inside the base of a design folder and write its PP_List_Coordinates file.
+
+    parts_file has a Designator and a Component column. connections_file, if given, has one
+    requested connection per row: Designator A, Pin A, Designator B, Pin B (pin indexes start at 0).
+    The new placement replaces the components of the design, so unless force is set, a design
+    that already has traces or pin connections raises ValueError. Returns the wirelength and
+    the overlap area of the best placement.
+    """
+    import multiprocessing
+
+    filename, filename_pp_coord, filename_base, filename_pins_selected, filename_layers = design_filenames(path)
+    if not force:
+        for routed in (filename, filename_pins_selected):
+            if os.path.exists(routed) and read_csv_rows(routed)[1]:
+                raise ValueError(
+                    "{}: {} is not empty, and its rows would point at components that no longer exist. "
+                    "Place into a new design folder, or use --force to replace the components anyway".format(path, routed)
+                )
+    x_base, y_base = read_base(filename_base)
+
+    header, part_rows = read_csv_rows(parts_file)
+    designators = [row[0] for row in part_rows]
+    components = [row[1] for row in part_rows]
+    connections = []
+    if connections_file is not None:
+        header, connection_rows = read_csv_rows(connections_file)
+        for row in connection_rows:
+            connections.append((designators.index(row[0]), int(row[1]), designators.index(row[2]), int(row[3])))
+
+    placer = AutoPlacer(components, connections, x_base, y_base, filename_pp, scaling_factor)
+
+    # Independent restarts in parallel, the best one is kept
+    pool = multiprocessing.Pool(min(restarts, multiprocessing.cpu_count()))
+    try:
+        results = pool.map(run_annealing, [(placer, seed, iterations) for seed in range(restarts)])
+    finally:
+        pool.close()
+        pool.join()
+    cost, positions, rotations = min(results, key=lambda result: result[0])
+    wirelength, overlap = placer.total_cost(positions, rotations)
+
+    # Write the placement with the same rows and tags the GUI would have written
+    rows = []
+    repeated = {}
+    for part, component in enumerate(components):
+        degree = placer.angles[rotations[part]]
+        x, y = int(round(positions[part, 0])), int(round(positions[part, 1]))
+        geometry = place_footprint(filename_pp, x, y, 20, component, math.radians(degree), scaling_factor)
+        x_perimeter, y_perimeter = perimeter_corners(geometry)
+        index = repeated.get((component, degree), 0)
+        repeated[(component, degree)] = index + 1
+        tag = "{}_{}_{}".format(component, index, float(degree))
+        rows.append([component, x, y, degree, x_perimeter, y_perimeter, tag])
+        print("{} -> {}".format(designators[part], tag))
+    write_csv_rows(filename_pp_coord, ["Component", "X", "Y", "Orientation", "Perimeter X", "Perimeter Y", "Tag"], rows)
+    return wirelength, overlap
+
+
+class MaxRectsSheet(object):
+    """Free space of one fabrication sheet for the MaxRects bin packing heuristic.
+
+    The free space is kept as a list of maximal free rectangles. A design goes where it leaves
+    the shortest leftover side (best short side fit), rotated by 90 degrees if that fits better.
+    """
+
+    def __init__(self, width, height, margin):
+        self.width = width
+        self.height = height
+        self.free = [(margin, margin, width - margin, height - margin)]  # x, y, width, height
+        self.placed = []
+
+    def find(self, width, height, rotate):
+        """Return (score, x, y, width, height, rotated) of the best position for a rectangle, or None."""
+        best = None
+        for free_x, free_y, free_width, free_height in self.free:
+            for rotated, (w, h) in ((False, (width, height)), (True, (height, width))):
+                if rotated and not rotate:
+                    continue
+                if w <= free_width and h <= free_height:
+                    leftover = (min(free_width - w, free_height - h), max(free_width - w, free_height - h))
+                    if best is None or leftover < best[0]:
+                        best = (leftover, free_x, free_y, w, h, rotated)
+        return best
+
+    def place(self, x, y, width, height):
+        """Remove a placed rectangle from the free rectangles."""
+        free_rectangles = []
+        for free_x, free_y, free_width, free_height in self.free:
+            if (x >= free_x + free_width or x + width <= free_x or y >= free_y + free_height or y + height <= free_y):
+                free_rectangles.append((free_x, free_y, free_width, free_height))
+                continue
+            # Split the intersected free rectangle into the (up to four) maximal parts around the placement
+            if x > free_x:
+                free_rectangles.append((free_x, free_y, x - free_x, free_height))
+            if x + width < free_x + free_width:
+                free_rectangles.append((x + width, free_y, free_x + free_width - x - width, free_height))
+            if y > free_y:
+                free_rectangles.append((free_x, free_y, free_width, y - free_y))
+            if y + height < free_y + free_height:
+                free_rectangles.append((free_x, y + height, free_width, free_y + free_height - y - height))
+
+        # Drop the free rectangles contained in another one
+        self.free = [
+            rectangle for i, rectangle in enumerate(free_rectangles)
+            if not any(
+                j != i and other[0] <= rectangle[0] and other[1] <= rectangle[1]
+                and rectangle[0] + rectangle[2] <= other[0] + other[2] and rectangle[1] + rectangle[3] <= other[1] + other[3]
+                and (other != rectangle or j < i)
+                for j, other in enumerate(free_rectangles)
+            )
+        ]
+
+
+def pack_designs(sizes, sheet_width, sheet_height, spacing, rotate=True):
+    """Pack rectangles on as many sheets as needed, return the sheets and where each rectangle went.
+
+    Every rectangle is grown by the spacing on its right and bottom side, and the sheets keep a
+    margin of the same size on their left and top side, so copies never touch the sheet edge.
+    Placements are (sheet index, x, y, rotated) in the order of sizes.
+    """
+    sheets = []
+    placements = [None] * len(sizes)
+    order = sorted(range(len(sizes)), key=lambda i: max(sizes[i]), reverse=True)
+    for i in order:
+        width, height = sizes[i][0] + spacing, sizes[i][1] + spacing
+        for sheet_index in range(len(sheets) + 1):
+            if sheet_index == len(sheets):
+                sheets.append(MaxRectsSheet(sheet_width, sheet_height, spacing))
+            best = sheets[sheet_index].find(width, height, rotate)
+            if best is not None:
+                break
+        if best is None:
+            sheets.pop()  # Larger than an empty sheet
+            continue
+        leftover, x, y, w, h, rotated = best
+        sheets[sheet_index].place(x, y, w, h)
+        sheets[sheet_index].placed.append(i)
+        placements[i] = (sheet_index, x, y, rotated)
+    return sheets, placements
+
+
+def panelize(output_name, designs, sheet_width, sheet_height, spacing=5.0, rotate=True,
+             filename_pp="Pick_and_place_components_with_pads.csv", scaling_factor=SCALING_FACTOR):
+    """Pack copies of design folders on fabrication sheets and write one merged design folder per sheet.
+
+    designs is a list of (design folder, copies). Sheet size and spacing are in mm. Components
+    and traces are re-tagged so every copy stays unique. The designs must use the same layers,
+    a design may only have fewer of them. Every design is checked before any folder is made, and
+    ValueError is raised for a component missing from the library, differing layers or an
+    existing output folder. Returns the folder and utilization of every sheet, and the number of
+    copies that do not fit on an empty sheet.
+    """
+    origin_x = 2
+    origin_y = 2
+
+    # Check every design before writing anything, and merge their layers
+    library = footprints.library(filename_pp)
+    layers = None
+    layers_path = None
+    layers_signature = []
+    for path in sorted(set(path for path, count in designs)):
+        in_filename, in_pp_coord, in_base, in_pins, in_layers = design_filenames(path)
+        header, rows = read_csv_rows(in_pp_coord)
+        missing = sorted(set(row[0] for row in rows if row[0] not in library))
+        if missing:
+            raise ValueError("{}: components not in the library: {}".format(path, ", ".join(missing)))
+        design_layers = LayerStack.read(in_layers)
+        header, rows = read_csv_rows(in_filename)
+        for row in rows:
+            design_layers.ensure(design_layers.layer(row[0]))
+        signature = [(name, float(width)) for name, width in zip(design_layers.names, design_layers.widths)]
+        if layers is not None and signature[:len(layers_signature)] != layers_signature[:len(signature)]:
+            raise ValueError("{} and {} have different layers, their names and widths must match".format(layers_path, path))
+        if layers is None or len(signature) > len(layers_signature):
+            layers, layers_path, layers_signature = design_layers, path, signature
+
+    # Size of every requested copy, from the base of its design
+    copies = []
+    sizes = []
+    for path, count in designs:
+        x_base, y_base = read_base(design_filenames(path)[2])
+        for copy in range(count):
+            copies.append((path, x_base[0], y_base[0]))
+            sizes.append((x_base[1] - x_base[0], y_base[1] - y_base[0]))
+    sheets, placements = pack_designs(
+        sizes, sheet_width * scaling_factor, sheet_height * scaling_factor, spacing * scaling_factor, rotate
+    )
+
+    names = [output_name] if len(sheets) == 1 else ["{}_{}".format(output_name, k + 1) for k in range(len(sheets))]
+    existing = [name for name in names if os.path.exists("./{}".format(name))]
+    if existing:
+        raise ValueError("The output folders already exist: {}".format(", ".join(existing)))
+    results = []
+    for sheet_index, sheet in enumerate(sheets):
+        name = names[sheet_index]
+        path_out = "./{}".format(name)
+        os.mkdir(path_out)
+        filename, filename_pp_coord, filename_base, filename_pins_selected, filename_layers = design_filenames(path_out)
+
+        component_rows = []
+        trace_rows = []
+        pin_rows = []
+        repeated = {}
+        for i in sorted(sheet.placed):
+            path, x0, y0 = copies[i]
+            width, height = sizes[i]
+            sheet_index, x_sheet, y_sheet, rotated = placements[i]
+            x_offset = origin_x + x_sheet
+            y_offset = origin_y + y_sheet
+
+            def transform(x, y):
+                """Move a point of the copy to the sheet, rotating it like the GUI rotates components."""
+                u, v = x - x0, y - y0
+                if rotated:
+                    u, v = v, width - u
+                return round(float(u + x_offset), 2), round(float(v + y_offset), 2)
+
+            in_filename, in_pp_coord, in_base, in_pins, in_layers = design_filenames(path)
+
+            # Components, re-tagged and turned by 90 degrees when the copy is rotated
+            tags = {}
+            header, rows = read_csv_rows(in_pp_coord)
+            for row in rows:
+                component = row[0]
+                degree = (int(float(row[3])) + (90 if rotated else 0)) % 360
+                x, y = transform(float(row[1]), float(row[2]))
+                geometry = place_footprint(filename_pp, x, y, 20, component, math.radians(degree), scaling_factor)
+                x_perimeter, y_perimeter = perimeter_corners(geometry)
+                index = repeated.get((component, degree), 0)
+                repeated[(component, degree)] = index + 1
+                tags[row[6]] = "{}_{}_{}".format(component, index, float(degree))
+                component_rows.append([component, x, y, degree, x_perimeter, y_perimeter, tags[row[6]]])
+
+            # Traces, re-tagged in sheet order
+            traces = {}
+            header, rows = read_csv_rows(in_filename)
+            for row in rows:
+                points = [transform(x, y) for x, y in zip(parse_coordinates(row[1]), parse_coordinates(row[2]))]
+                prefix = "hatch" if row[3].startswith("hatch_") else "line"
+                traces[row[3]] = "{}_{}".format(prefix, len(trace_rows) + 1)
+                trace_rows.append([row[0], [x for x, y in points], [y for x, y in points], traces[row[3]]])
+
+            # Pin connections, following the new tags
+            if os.path.exists(in_pins):
+                header, rows = read_csv_rows(in_pins)
+                for row in rows:
+                    if row[3] not in tags:
+                        continue
+                    x, y = transform(float(row[0]), float(row[1]))
+                    pin = row[4] if len(row) > 4 else ""
+                    trace = traces.get(row[5], "") if len(row) > 5 else ""
+                    pin_rows.append([x, y, row[2], tags[row[3]], pin, trace])
+
+        write_csv_rows(filename, ["Tunnel", "X", "Y", "Tag"], trace_rows)
+        write_csv_rows(filename_pp_coord, ["Component", "X", "Y", "Orientation", "Perimeter X", "Perimeter Y", "Tag"], component_rows)
+        write_csv_rows(filename_pins_selected, PinConnections.header, pin_rows)
+        x_border = origin_x + sheet_width * scaling_factor
+        y_border = origin_y + sheet_height * scaling_factor
+        write_csv_rows(filename_base, ["Base X", "Base Y"], [[[origin_x, x_border], [origin_y, y_border]]])
+        (layers or LayerStack()).write(filename_layers)
+
+        used_area = sum(sizes[i][0] * sizes[i][1] for i in sheet.placed)
+        results.append((path_out, used_area / float(sheet_width * sheet_height * scaling_factor ** 2)))
+
+    return results, placements.count(None)
+
+
+def write_png(filename, width, height, dpi, bands):
+    """Write a 1 bit grayscale PNG from bands of packed rows, one band in memory at a time."""
+    def chunk(output, kind, data):
+        output.write(struct.pack(">I", len(data)))
+        output.write(kind + data)
+        output.write(struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff))
+
+    row_bytes = (width + 7) // 8
+    pixels_per_meter = int(round(dpi / 0.0254))
+    compressor = zlib.compressobj(6)
+    with open(filename, "wb") as output:
+        output.write(b"\x89PNG\r\n\x1a\n")
+        chunk(output, b"IHDR", struct.pack(">IIBBBBB", width, height, 1, 0, 0, 0, 0))
+        chunk(output, b"pHYs", struct.pack(">IIB", pixels_per_meter, pixels_per_meter, 1))
+        for band in bands:
+            # Every row starts with filter type 0
+            data = b"".join(b"\x00" + band[i:i + row_bytes] for i in range(0, len(band), row_bytes))
+            compressed = compressor.compress(data)
+            if compressed:
+                chunk(output, b"IDAT", compressed)
+        chunk(output, b"IDAT", compressor.flush())
+        chunk(output, b"IEND", b"")
+
+
+def write_tiff(filename, width, height, dpi, bands):
+    """Write an uncompressed 1 bit TIFF from bands of packed rows, one strip per band."""
+    row_bytes = (width + 7) // 8
+    offsets = []
+    counts = []
+    with open(filename, "wb") as output:
+        output.write(b"II*\x00\x00\x00\x00\x00")
+        for band in bands:
+            offsets.append(output.tell())
+            counts.append(len(band))
+            output.write(band)
+        rows_per_strip = counts[0] // row_bytes
+
+        # Strip tables and resolution after the image data, then the directory
+        if output.tell() % 2:
+            output.write(b"\x00")
+        offsets_at = output.tell()
+        output.write(struct.pack("<{}I".format(len(offsets)), *offsets))
+        counts_at = output.tell()
+        output.write(struct.pack("<{}I".format(len(counts)), *counts))
+        resolution_at = output.tell()
+        output.write(struct.pack("<II", int(round(dpi * 100)), 100))
+        entries = [
+            (256, 4, 1, width),  # ImageWidth
+            (257, 4, 1, height),  # ImageLength
+            (258, 3, 1, 1),  # BitsPerSample
+            (259, 3, 1, 1),  # Compression: none
+            (262, 3, 1, 1),  # PhotometricInterpretation: black is zero
+            (273, 4, len(offsets), offsets[0] if len(offsets) == 1 else offsets_at),  # StripOffsets
+            (278, 4, 1, rows_per_strip),  # RowsPerStrip
+            (279, 4, len(counts), counts[0] if len(counts) == 1 else counts_at),  # StripByteCounts
+            (282, 5, 1, resolution_at),  # XResolution
+            (283, 5, 1, resolution_at),  # YResolution
+            (296, 3, 1, 2),  # ResolutionUnit: inch
+        ]
+        directory_at = output.tell()
+        output.write(struct.pack("<H", len(entries)))
+        for tag, kind, count, value in entries:
+            if kind == 3:
+                output.write(struct.pack("<HHIHH", tag, kind, count, value, 0))
+            else:
+                output.write(struct.pack("<HHII", tag, kind, count, value))
+        output.write(struct.pack("<I", 0))
+        output.seek(4)
+        output.write(struct.pack("<I", directory_at))
+
+
+def render_tile(arguments):
+    """Process pool entry point, draw the segments and discs of one tile and return its packed rows."""
+    width, height, segments, discs = arguments
+    Image, ImageDraw = import_pil_draw()
+    tile = Image.new("1", (width, height), 0)
+    draw = ImageDraw.Draw(tile)
+    # Segments are drawn with round ends so the joints of a trace have no notches
+    for x0, y0, x1, y1, radius in segments:
+        draw.line([(x0, y0), (x1, y1)], fill=1, width=max(1, int(round(2 * radius))))
+        draw.ellipse([x0 - radius, y0 - radius, x0 + radius, y0 + radius], fill=1)
+        draw.ellipse([x1 - radius, y1 - radius, x1 + radius, y1 + radius], fill=1)
+    for x, y, radius in discs:
+        draw.ellipse([x - radius, y - radius, x + radius, y + radius], fill=1)
+    return tile.tobytes()
+
+
+def rasterize(path, dpi=1200, trace_width=None, pad_diameter=1.0, via_diameter=1.2, image_format="png",
+              tile_size=2048, filename_pp="Pick_and_place_components_with_pads.csv", scaling_factor=SCALING_FACTOR):
+    """Render one fabrication mask per layer of a design folder, without opening a window.
+
+    Widths and diameters are in mm. trace_width defaults to the line width of every layer.
+    Component pads are drawn on the first layer and vias on every layer. The image is rendered
+    in square tiles by a process pool, one row of tiles at a time, so the memory used does not
+    grow with the sheet size. Returns the mask filenames.
+    """
+    import multiprocessing
+
+    filename, filename_pp_coord, filename_base, filename_pins_selected, filename_layers = design_filenames(path)
+    x_base, y_base = read_base(filename_base)
+    layers = LayerStack.read(filename_layers)
+
+    # Canvas pixels to image pixels, the origin is the corner of the base
+    scale = dpi / 25.4 / scaling_factor
+    width = int(math.ceil((x_base[1] - x_base[0]) * scale))
+    height = int(math.ceil((y_base[1] - y_base[0]) * scale))
+
+    # Segments (x0, y0, x1, y1, radius) of every layer
+    segments = {}
+    header, rows = read_csv_rows(filename)
+    for row in rows:
+        layer = layers.layer(row[0])
+        layers.ensure(layer)
+        if trace_width is None:
+            radius = layers.widths[layer] * scale / 2.0
+        else:
+            radius = trace_width * dpi / 25.4 / 2.0
+        x = (np.asarray(parse_coordinates(row[1])) - x_base[0]) * scale
+        y = (np.asarray(parse_coordinates(row[2])) - y_base[0]) * scale
+        if len(x) < 2:
+            continue  # Empty saves of older versions wrote traces without segments
+        points = np.column_stack((x[:-1], y[:-1], x[1:], y[1:], np.full(len(x) - 1, radius)))
+        segments.setdefault(layer, []).append(points)
+
+    # Discs (x, y, radius), pads on the first layer and vias on all of them
+    pads = []
+    vias = []
+    header, rows = read_csv_rows(filename_pp_coord)
+    for row in rows:
+        x_center, y_center = float(row[1]), float(row[2])
+        geometry = place_footprint(filename_pp, x_center, y_center, 20, row[0], math.radians(float(row[3])), scaling_factor)
+        x = (np.asarray(geometry[0]) - x_base[0]) * scale
+        y = (np.asarray(geometry[1]) - y_base[0]) * scale
+        pads.append(np.column_stack((x, y, np.full(len(x), pad_diameter * dpi / 25.4 / 2.0))))
+        if row[0] == "Via":
+            vias.append([(x_center - x_base[0]) * scale, (y_center - y_base[0]) * scale, via_diameter * dpi / 25.4 / 2.0])
+
+    name = os.path.basename(os.path.normpath(path))
+    writer = write_tiff if image_format == "tiff" else write_png
+    outputs = []
+    Image, ImageDraw = import_pil_draw()
+    pool = multiprocessing.Pool()
+    try:
+        for layer in range(len(layers)):
+            layer_segments = np.concatenate(segments.get(layer, []) + [np.zeros((0, 5))])
+            layer_discs = np.concatenate((pads if layer == 0 else []) + [np.array(vias).reshape(-1, 3)])
+
+            # Bounding boxes, to hand every tile only what touches it
+            segment_box = np.column_stack((
+                np.minimum(layer_segments[:, 0], layer_segments[:, 2]) - layer_segments[:, 4],
+                np.minimum(layer_segments[:, 1], layer_segments[:, 3]) - layer_segments[:, 4],
+                np.maximum(layer_segments[:, 0], layer_segments[:, 2]) + layer_segments[:, 4],
+                np.maximum(layer_segments[:, 1], layer_segments[:, 3]) + layer_segments[:, 4],
+            ))
+            disc_box = np.column_stack((
+                layer_discs[:, 0] - layer_discs[:, 2],
+                layer_discs[:, 1] - layer_discs[:, 2],
+                layer_discs[:, 0] + layer_discs[:, 2],
+                layer_discs[:, 1] + layer_discs[:, 2],
+            ))
+
+            def band_tiles(top, band_height):
+                """Return the render_tile arguments of the tiles of one row."""
+                tiles = []
+                for left in range(0, width, tile_size):
+                    tile_width = min(tile_size, width - left)
+                    shift = np.array([left, top, left, top])
+                    inside = ((segment_box[:, 0] < left + tile_width) & (segment_box[:, 2] >= left)
+                              & (segment_box[:, 1] < top + band_height) & (segment_box[:, 3] >= top))
+                    tile_segments = layer_segments[inside].copy()
+                    tile_segments[:, :4] -= shift
+                    inside = ((disc_box[:, 0] < left + tile_width) & (disc_box[:, 2] >= left)
+                              & (disc_box[:, 1] < top + band_height) & (disc_box[:, 3] >= top))
+                    tile_discs = layer_discs[inside].copy()
+                    tile_discs[:, :2] -= shift[:2]
+                    tiles.append((tile_width, band_height, tile_segments.tolist(), tile_discs.tolist()))
+                return tiles
+
+            def bands():
+                """Render the image one row of tiles at a time."""
+                for top in range(0, height, tile_size):
+                    band_height = min(tile_size, height - top)
+                    band = Image.new("1", (width, band_height), 0)
+                    left = 0
+                    for data in pool.imap(render_tile, band_tiles(top, band_height)):
+                        tile_width = min(tile_size, width - left)
+                        band.paste(Image.frombytes("1", (tile_width, band_height), data), (left, 0))
+                        left += tile_width
+                    yield band.tobytes()
+
+            output = os.path.join(path, "Mask_{}_{}.{}".format(name, layers.names[layer].replace(" ", "_"), image_format))
+            writer(output, width, height, dpi, bands())
+            outputs.append(output)
+    finally:
+        pool.close()
+        pool.join()
+    return outputs
+
+
+PICK_AND_PLACE_COLUMNS = {
+    # Normalized header names used by common EDA tools for each pick-and-place column
+    "designator": ["designator", "ref", "reference", "refdes", "part", "partname"],
+    "footprint": ["footprint", "package", "pattern", "footprintname", "case"],
+    "x": ["x", "posx", "midx", "centerx", "refx", "locationx", "centroidx"],
+    "y": ["y", "posy", "midy", "centery", "refy", "locationy", "centroidy"],
+    "rotation": ["rotation", "rot", "angle", "orientation"],
+    "net": ["net", "netname", "signal"],
+    "pin": ["pin", "pinnumber", "pad", "padnumber"],
+    "component": ["component"],
+}
+
+
+def normalize_column(name):
+    """Return a header cell lowercased, without units and punctuation."""
+    name = name.lower()
+    for unit in ("(mm)", "(mil)", "[mm]", "[mil]"):
+        name = name.replace(unit, "")
+    return "".join(character for character in name if character.isalnum())
+
+
+def read_eda_csv(filename, required):
+    """Read a CSV exported by an EDA tool, return the index of every column and the data rows.
+
+    Tools write a few lines of comments before the header, which are skipped. Values of
+    columns whose header is in mils are converted to mm.
+    """
+    with open(filename, "rb") as f:
+        rows = [[cell.strip() for cell in row] for row in csv.reader(f) if row and any(cell.strip() for cell in row)]
+    for start, header in enumerate(rows):
+        names = [normalize_column(cell) for cell in header]
+        columns = {}
+        for column, aliases in PICK_AND_PLACE_COLUMNS.items():
+            for alias in aliases:
+                if alias in names:
+                    columns[column] = names.index(alias)
+                    break
+        if all(column in columns for column in required):
+            mils = [index for index, cell in enumerate(header) if "mil" in cell.lower()]
+            return columns, mils, rows[start + 1:]
+    raise ValueError("{}: no header with the columns {}".format(filename, ", ".join(required)))
+
+
+def eda_length(value, mils=False):
+    """Return a length cell in mm, the unit may be written after the number."""
+    value = value.lower().strip()
+    if value.endswith("mil"):
+        return float(value[:-3]) * 0.0254
+    if value.endswith("mm"):
+        value = value[:-2]
+    return float(value) * 0.0254 if mils else float(value)
+
+
+def import_pick_and_place(name, pnp_file, netlist_file=None, footprint_map=None, margin=5.0,
+                          filename_pp="Pick_and_place_components_with_pads.csv", scaling_factor=SCALING_FACTOR):
+    """Create a design folder from the pick-and-place file of an EDA tool.
+
+    pnp_file has a designator, footprint, x, y and rotation column, in mm or mils. Footprints
+    are library components, or are translated by footprint_map (Footprint, Component). The
+    optional netlist_file (Net, Designator, Pin, with pins numbered from 1) adds one pin record
+    per connected pin, not yet routed. The base surrounds the parts with a margin in mm.
+    Returns the number of parts placed, the designators of the parts that were skipped and the
+    netlist pins (designator.pin) that are not a pin number of their footprint.
+    """
+    origin_x = 2
+    origin_y = 2
+    library = footprints.library(filename_pp)
+    mapping = {}
+    if footprint_map is not None:
+        header, rows = read_csv_rows(footprint_map)
+        mapping = dict((row[0], row[1]) for row in rows)
+
+    # Parts whose footprint is in the library, in file order
+    columns, mils, rows = read_eda_csv(pnp_file, ["designator", "footprint", "x", "y", "rotation"])
+    designators = []
+    components = []
+    skipped = []
+    x_mm = []
+    y_mm = []
+    angles = []
+    for row in rows:
+        component = mapping.get(row[columns["footprint"]], row[columns["footprint"]])
+        if component not in library:
+            skipped.append(row[columns["designator"]])
+            continue
+        designators.append(row[columns["designator"]])
+        components.append(component)
+        x_mm.append(eda_length(row[columns["x"]], columns["x"] in mils))
+        y_mm.append(eda_length(row[columns["y"]], columns["y"] in mils))
+        angles.append(float(row[columns["rotation"]].lower().replace("deg", "")))
+    if not components:
+        raise ValueError("{}: no footprint is in the component library".format(pnp_file))
+
+    # EDA tools count the rotation counterclockwise with y up, like the GUI does on screen
+    x_centers = np.array(x_mm) * scaling_factor
+    y_centers = -np.array(y_mm) * scaling_factor
+    degrees = (np.round(np.array(angles) / 90.0).astype(int) * 90) % 360
+
+    # One footprint template per component and rotation, translated to all its parts at once
+    groups = {}
+    for part, key in enumerate(zip(components, degrees.tolist())):
+        groups.setdefault(key, []).append(part)
+    templates = {}
+    x_min = y_min = np.inf
+    x_max = y_max = -np.inf
+    for (component, degree), parts in groups.items():
+        template = footprints.template(filename_pp, component, math.radians(degree), 20, scaling_factor)
+        templates[(component, degree)] = template
+        x_outline = np.concatenate(template[0::2])
+        y_outline = np.concatenate(template[1::2])
+        x_min = min(x_min, (x_centers[parts] + x_outline.min()).min())
+        x_max = max(x_max, (x_centers[parts] + x_outline.max()).max())
+        y_min = min(y_min, (y_centers[parts] + y_outline.min()).min())
+        y_max = max(y_max, (y_centers[parts] + y_outline.max()).max())
+    x_centers = np.round(x_centers + origin_x + margin * scaling_factor - x_min, 2)
+    y_centers = np.round(y_centers + origin_y + margin * scaling_factor - y_min, 2)
+
+    corners_x = np.zeros((len(components), 4))
+    corners_y = np.zeros((len(components), 4))
+    for key, parts in groups.items():
+        x_top, y_top, x_bottom, y_bottom = templates[key][2:6]
+        corners_x[parts] = np.round(x_centers[parts, None] + [x_top[0], x_top[-1], x_bottom[-1], x_bottom[0]], 2)
+        corners_y[parts] = np.round(y_centers[parts, None] + [y_top[0], y_top[-1], y_bottom[-1], y_bottom[0]], 2)
+
+    # Components rows, tagged like the GUI tags them
+    path = "./{}".format(name)
+    os.mkdir(path)
+    filename, filename_pp_coord, filename_base, filename_pins_selected, filename_layers = design_filenames(path)
+    tags = []
+    repeated = {}
+    component_rows = []
+    for part, component in enumerate(components):
+        degree = int(degrees[part])
+        index = repeated.get((component, degree), 0)
+        repeated[(component, degree)] = index + 1
+        tags.append("{}_{}_{}".format(component, index, float(degree)))
+        component_rows.append([
+            component, float(x_centers[part]), float(y_centers[part]), degree, corners_x[part].tolist(), corners_y[part].tolist(), tags[part]
+        ])
+
+    # Pin records of the netlist, waiting for a trace
+    connections = PinConnections()
+    skipped_pins = []
+    if netlist_file is not None:
+        parts = dict((designator, part) for part, designator in enumerate(designators))
+        net_columns, net_mils, net_rows = read_eda_csv(netlist_file, ["net", "designator", "pin"])
+        for row in net_rows:
+            part = parts.get(row[net_columns["designator"]])
+            if part is None:
+                continue
+            template = templates[(components[part], int(degrees[part]))]
+            pin_name = row[net_columns["pin"]]
+            if not pin_name.isdigit() or not 1 <= int(pin_name) <= len(template[0]):
+                skipped_pins.append("{}.{}".format(row[net_columns["designator"]], pin_name))
+                continue
+            pin = int(pin_name) - 1
+            x = round(float(x_centers[part] + template[0][pin]), 2)
+            y = round(float(y_centers[part] + template[1][pin]), 2)
+            connections.add(x, y, components[part], tags[part], pin, "")
+
+    write_csv_rows(filename_pp_coord, ["Component", "X", "Y", "Orientation", "Perimeter X", "Perimeter Y", "Tag"], component_rows)
+    write_csv_rows(filename, ["Tunnel", "X", "Y", "Tag"], [])
+    connections.write(filename_pins_selected)
+    x_border = round(float(x_max - x_min) + 2 * margin * scaling_factor + origin_x, 2)
+    y_border = round(float(y_max - y_min) + 2 * margin * scaling_factor + origin_y, 2)
+    write_csv_rows(filename_base, ["Base X", "Base Y"], [[[origin_x, x_border], [origin_y, y_border]]])
+    LayerStack().write(filename_layers)
+    return len(components), skipped, skipped_pins
+
+
+def analyze_traces(path, sheet_resistance, trace_width=None, strain=0.3, strain_axis="x", poisson=0.5,
+                   budget=None, scaling_factor=SCALING_FACTOR):
+    """Compute the length and resistance of every trace of a design folder, at rest and under strain.
+
+    sheet_resistance is in ohm per square, one value per layer (the last one is used for the
+    layers after it). trace_width is in mm and defaults to the line width of every layer. The
+    strain is uniaxial along strain_axis: every segment is stretched by (1 + strain) along the
+    axis and shrinks by poisson * strain across it and in thickness. Every segment of the design
+    is computed at once, then summed per trace. Returns the table of traces and the total length
+    of every layer, and writes the table to Resistance_<design>.csv.
+    """
+    pd = import_pandas()
+    filename, filename_pp_coord, filename_base, filename_pins_selected, filename_layers = design_filenames(path)
+    layers = LayerStack.read(filename_layers)
+
+    # Segments of all the traces in one set of arrays, with the trace each belongs to
+    header, rows = read_csv_rows(filename)
+    tags = [row[3] for row in rows]
+    trace_layers = np.array([layers.layer(row[0]) for row in rows], dtype=int)
+    layers.ensure(int(trace_layers.max()) if len(rows) else 0)
+    points = [(parse_coordinates(row[1]), parse_coordinates(row[2])) for row in rows]
+    counts = np.array([max(len(x) - 1, 0) for x, y in points], dtype=int)
+    x0 = np.concatenate([x[:-1] for x, y in points] + [[]]) / scaling_factor
+    y0 = np.concatenate([y[:-1] for x, y in points] + [[]]) / scaling_factor
+    x1 = np.concatenate([x[1:] for x, y in points] + [[]]) / scaling_factor
+    y1 = np.concatenate([y[1:] for x, y in points] + [[]]) / scaling_factor
+    trace = np.repeat(np.arange(len(rows)), counts)
+    layer = trace_layers[trace]
+
+    # Width and sheet resistance of every segment, from its layer
+    if trace_width is None:
+        widths = np.array(layers.widths, dtype=float) / scaling_factor
+    else:
+        widths = np.full(len(layers), trace_width)
+    sheet = np.array([sheet_resistance[min(k, len(sheet_resistance) - 1)] for k in range(len(layers))], dtype=float)
+    width = widths[layer]
+    resistance_square = sheet[layer]
+
+    # At rest
+    dx = x1 - x0
+    dy = y1 - y0
+    length = np.hypot(dx, dy)
+    resistance = resistance_square * length / width
+
+    # Under strain, the direction cosines give the stretch along and across every segment
+    along, across = (dx, dy) if strain_axis == "x" else (dy, dx)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cos_axis = np.where(length > 0, along / length, 1.0)
+        sin_axis = np.where(length > 0, across / length, 0.0)
+    stretch = 1 + strain
+    shrink = 1 - poisson * strain
+    length_strained = length * np.hypot(stretch * cos_axis, shrink * sin_axis)
+    width_strained = width * np.hypot(stretch * sin_axis, shrink * cos_axis)
+    resistance_strained = resistance_square / shrink * length_strained / width_strained
+
+    # Sums per trace and per layer
+    table = pd.DataFrame({
+        "Trace": tags,
+        "Layer": [layers.names[k] for k in trace_layers],
+        "Segments": counts,
+        "Length (mm)": np.bincount(trace, length, len(rows)),
+        "Resistance (ohm)": np.bincount(trace, resistance, len(rows)),
+        "Strained length (mm)": np.bincount(trace, length_strained, len(rows)),
+        "Strained resistance (ohm)": np.bincount(trace, resistance_strained, len(rows)),
+    }, columns=["Trace", "Layer", "Segments", "Length (mm)", "Resistance (ohm)", "Strained length (mm)", "Strained resistance (ohm)"])
+    if budget is not None:
+        table["Over budget"] = table["Strained resistance (ohm)"] > budget
+    layer_lengths = pd.Series(np.bincount(layer, length, len(layers)), index=layers.names, name="Length (mm)")
+
+    name = os.path.basename(os.path.normpath(path))
+    table.to_csv(os.path.join(path, "Resistance_{}.csv".format(name)), index=False, float_format="%.4f")
+    return table, layer_lengths
+
+
+class TraceOutlines(object):
+    """Conductor outlines of saved traces, cached by trace tag.
+
+    An outline is the centerline of a trace buffered by half its width, with round joins and
+    ends or miter joins and square ends. The outline of a tag is reused while the hash of the
+    coordinates, width and join of the trace stays the same. The cache is saved in the design
+    folder, so the next run only buffers the traces edited since.
+    """
+
+    header = ["Tag", "Hash", "Outline"]
+
+    def __init__(self, resolution=8):
+        self.resolution = resolution  # Segments per quarter circle of the round joins
+        self.outlines = {}
+
+    @classmethod
+    def read(cls, filename, resolution=8):
+        """Read the outlines saved by write, an empty cache if the file does not exist."""
+        outlines = cls(resolution)
+        if os.path.exists(filename):
+            shapely = import_shapely()
+            header, rows = read_csv_rows(filename)
+            for row in rows:
+                outlines.outlines[row[0]] = (row[1], shapely.wkb.loads(row[2], hex=True))
+        return outlines
+
+    def write(self, filename, tags):
+        """Write the outlines of the given trace tags, the traces that still exist."""
+        rows = [[tag, self.outlines[tag][0], self.outlines[tag][1].wkb_hex] for tag in tags if tag in self.outlines]
+        write_csv_rows(filename, self.header, rows)
+
+    def outline(self, tag, x, y, width, join="round"):
+        """Return the outline polygon of a trace, buffering it only if it changed."""
+        key = hashlib.md5(repr((self.resolution, tuple(x), tuple(y), width, join)).encode("ascii")).hexdigest()
+        cached = self.outlines.get(tag)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        shapely = import_shapely()
+        CAP_STYLE, JOIN_STYLE = shapely.geometry.CAP_STYLE, shapely.geometry.JOIN_STYLE
+        if join == "miter":
+            cap_style, join_style = CAP_STYLE.square, JOIN_STYLE.mitre
+        else:
+            cap_style, join_style = CAP_STYLE.round, JOIN_STYLE.round
+        points = list(zip(x, y))
+        if len(set(points)) < 2:
+            centerline = shapely.geometry.Point(points[0])
+        else:
+            centerline = shapely.geometry.LineString(points)
+        outline = centerline.buffer(width / 2.0, self.resolution, cap_style=cap_style, join_style=join_style)
+        self.outlines[tag] = (key, outline)
+        return outline
+
+
+def conductor_polygons(path, join="round", trace_width=None, pad_diameter=1.0, via_diameter=1.2, outlines=None,
+                       filename_pp="Pick_and_place_components_with_pads.csv", scaling_factor=SCALING_FACTOR):
+    """Return the merged conductor polygons of every layer of a design folder, in mm, and its layers.
+
+    Trace outlines use trace_width in mm, or the line width of their layer. Component pads are
+    merged on the first layer and vias on every layer, like the fabrication masks. The shapes
+    of a layer are merged with one cascaded union, which unions spatially close shapes first
+    instead of adding the shapes one by one. Trace outlines come from the outlines cache, read
+    from and saved to Outlines_<design>.csv unless a TraceOutlines is given.
+    """
+    shapely = import_shapely()
+    filename, filename_pp_coord, filename_base, filename_pins_selected, filename_layers = design_filenames(path)
+    layers = LayerStack.read(filename_layers)
+    filename_outlines = os.path.join(path, "Outlines_{}.csv".format(os.path.basename(os.path.normpath(path))))
+    cache = outlines is None
+    if cache:
+        outlines = TraceOutlines.read(filename_outlines)
+
+    shapes = dict((layer, []) for layer in range(len(layers)))
+    header, rows = read_csv_rows(filename)
+    for row in rows:
+        layer = layers.layer(row[0])
+        layers.ensure(layer)
+        shapes.setdefault(layer, [])
+        width = layers.widths[layer] / float(scaling_factor) if trace_width is None else trace_width
+        x = [value / scaling_factor for value in parse_coordinates(row[1])]
+        y = [value / scaling_factor for value in parse_coordinates(row[2])]
+        if x:
+            shapes[layer].append(outlines.outline(row[3], x, y, width, join))
+    if cache:
+        outlines.write(filename_outlines, [row[3] for row in rows])
+
+    # Pads and vias
+    header, rows = read_csv_rows(filename_pp_coord)
+    for row in rows:
+        x_center, y_center = float(row[1]), float(row[2])
+        footprint = place_footprint(filename_pp, x_center, y_center, 20, row[0], math.radians(float(row[3])), scaling_factor)
+        for x, y in zip(footprint[0], footprint[1]):
+            shapes[0].append(shapely.geometry.Point(x / scaling_factor, y / scaling_factor).buffer(pad_diameter / 2.0))
+        if row[0] == "Via":
+            via = shapely.geometry.Point(x_center / scaling_factor, y_center / scaling_factor).buffer(via_diameter / 2.0)
+            for layer in shapes:
+                shapes[layer].append(via)
+
+    polygons = {}
+    for layer, layer_shapes in shapes.items():
+        merged = shapely.ops.unary_union(layer_shapes)
+        polygons[layer] = [polygon for polygon in getattr(merged, "geoms", [merged]) if not polygon.is_empty]
+    return polygons, layers
+
+
+def clearance_violations(polygons, clearance):
+    """Return (layer, conductor, conductor, distance) for the conductors of a layer closer than clearance (mm)."""
+    violations = []
+    for layer, shapes in polygons.items():
+        # Bounding boxes first, the exact distance only for the boxes closer than the clearance
+        bounds = np.array([shape.bounds for shape in shapes], dtype=float).reshape(-1, 4)
+        for i in range(len(shapes)):
+            near = np.flatnonzero(
+                (bounds[i + 1:, 0] < bounds[i, 2] + clearance) & (bounds[i + 1:, 2] > bounds[i, 0] - clearance)
+                & (bounds[i + 1:, 1] < bounds[i, 3] + clearance) & (bounds[i + 1:, 3] > bounds[i, 1] - clearance)
+            ) + i + 1
+            for j in near:
+                distance = shapes[i].distance(shapes[j])
+                if distance < clearance:
+                    violations.append((layer, i, int(j), distance))
+    return violations
+
+
+def write_conductors(filename, polygons, layers):
+    """Write merged conductor polygons, one row per ring (ring 0 is the outline, the others are holes)."""
+    rows = []
+    for layer in sorted(polygons):
+        for index, polygon in enumerate(polygons[layer]):
+            for ring, coordinates in enumerate([polygon.exterior] + list(polygon.interiors)):
+                x, y = zip(*coordinates.coords)
+                rows.append([layers.names[layer], index, ring, [round(value, 4) for value in x], [round(value, 4) for value in y]])
+    write_csv_rows(filename, ["Layer", "Conductor", "Ring", "X", "Y"], rows)
+
+
+class GroundFill(object):
+    """Ground or shield fill of a substrate, computed on a numpy occupancy grid in mm.
+
+    The grid is cut in square tiles of cells. The obstacles of a tile are rasterized again only
+    when the shapes that touch it change, and the obstacles are saved between fills, so a fill
+    after an edit only rasterizes the tiles the edit touched. The flood and the outline always
+    cover the whole grid: the fill grows from the ground pin a whole run of cells at a time,
+    alternating rows and columns, and its outline follows the cell edges.
+    """
+
+    def __init__(self, x_base, y_base, cell=0.25, tile=64):
+        self.cell = cell
+        self.tile = tile
+        self.x0 = x_base[0]
+        self.y0 = y_base[0]
+        self.columns = int(math.ceil((x_base[1] - x_base[0]) / cell))
+        self.rows = int(math.ceil((y_base[1] - y_base[0]) / cell))
+        self.x_cells = self.x0 + (np.arange(self.columns) + 0.5) * cell
+        self.y_cells = self.y0 + (np.arange(self.rows) + 0.5) * cell
+        self.obstacles = np.zeros((self.rows, self.columns), dtype=bool)
+        self.fill = np.zeros((self.rows, self.columns), dtype=bool)
+        self.tile_shapes = {}  # (first row, first column) of a tile -> hash of the shapes it was rasterized with
+
+    @classmethod
+    def read(cls, filename, x_base, y_base, cell=0.25, tile=64):
+        """Return an engine with the obstacles saved by write, or a new one if the grid changed."""
+        engine = cls(x_base, y_base, cell, tile)
+        if not os.path.exists(filename):
+            return engine
+        with np.load(filename) as saved:
+            if not np.array_equal(saved["grid"], engine.grid()):
+                return engine
+            engine.obstacles = saved["obstacles"]
+            for (top, left), key in zip(saved["tiles"].tolist(), saved["keys"].tolist()):
+                engine.tile_shapes[(top, left)] = str(key)
+        return engine
+
+    def write(self, filename):
+        """Save the obstacles and the shapes of every tile, for the next fill of the same layer."""
+        with open(filename, "wb") as f:
+            np.savez_compressed(
+                f, grid=self.grid(), obstacles=self.obstacles,
+                tiles=np.array(sorted(self.tile_shapes), dtype=int).reshape(-1, 2),
+                keys=np.array([self.tile_shapes[key] for key in sorted(self.tile_shapes)], dtype="U32"),
+            )
+
+    def grid(self):
+        """Return the origin, cell, size and tile of the grid."""
+        return np.array([self.x0, self.y0, self.cell, self.rows, self.columns, self.tile], dtype=float)
+
+    def tiles(self):
+        """Return the (row, column) slices of every tile."""
+        for top in range(0, self.rows, self.tile):
+            for left in range(0, self.columns, self.tile):
+                yield slice(top, min(top + self.tile, self.rows)), slice(left, min(left + self.tile, self.columns))
+
+    def set_obstacles(self, rectangles, discs, segments, openings):
+        """Rasterize the tiles whose shapes changed, return the number of tiles rasterized.
+
+        rectangles are (x0, y0, x1, y1), discs (x, y, radius) and segments (x0, y0, x1, y1,
+        radius), all already grown by the clearance. openings are discs (x, y, radius) cut out of
+        the obstacles, where the fill connects to the ground net.
+        """
+        rectangles = np.asarray(rectangles, dtype=float).reshape(-1, 4)
+        discs = np.asarray(discs, dtype=float).reshape(-1, 3)
+        segments = np.asarray(segments, dtype=float).reshape(-1, 5)
+        openings = np.asarray(openings, dtype=float).reshape(-1, 3)
+        boxes = [
+            rectangles,
+            np.column_stack((discs[:, 0] - discs[:, 2], discs[:, 1] - discs[:, 2], discs[:, 0] + discs[:, 2], discs[:, 1] + discs[:, 2])),
+            np.column_stack((
+                np.minimum(segments[:, 0], segments[:, 2]) - segments[:, 4], np.minimum(segments[:, 1], segments[:, 3]) - segments[:, 4],
+                np.maximum(segments[:, 0], segments[:, 2]) + segments[:, 4], np.maximum(segments[:, 1], segments[:, 3]) + segments[:, 4],
+            )),
+            np.column_stack((openings[:, 0] - openings[:, 2], openings[:, 1] - openings[:, 2], openings[:, 0] + openings[:, 2], openings[:, 1] + openings[:, 2])),
+        ]
+
+        rasterized = 0
+        for rows, columns in self.tiles():
+            x_min, x_max = self.x0 + columns.start * self.cell, self.x0 + columns.stop * self.cell
+            y_min, y_max = self.y0 + rows.start * self.cell, self.y0 + rows.stop * self.cell
+            touching = [
+                (box[:, 0] < x_max) & (box[:, 2] > x_min) & (box[:, 1] < y_max) & (box[:, 3] > y_min) for box in boxes
+            ]
+            shapes = [rectangles[touching[0]], discs[touching[1]], segments[touching[2]], openings[touching[3]]]
+            key = hashlib.md5(b"|".join(shape.tobytes() for shape in shapes)).hexdigest()
+            if self.tile_shapes.get((rows.start, columns.start)) == key:
+                continue
+            self.tile_shapes[(rows.start, columns.start)] = key
+            self.obstacles[rows, columns] = self.rasterize(self.x_cells[columns], self.y_cells[rows], *shapes)
+            rasterized += 1
+        return rasterized
+
+    def rasterize(self, x, y, rectangles, discs, segments, openings):
+        """Return the occupancy of the cells centered on the x and y coordinates of a tile."""
+        x, y = np.meshgrid(x, y)
+        occupied = np.zeros(x.shape, dtype=bool)
+        for x0, y0, x1, y1 in rectangles:
+            occupied |= (x >= x0) & (x <= x1) & (y >= y0) & (y <= y1)
+        for x_center, y_center, radius in discs:
+            occupied |= (x - x_center) ** 2 + (y - y_center) ** 2 <= radius ** 2
+        for x0, y0, x1, y1, radius in segments:
+            # Distance from every cell to the segment
+            dx, dy = x1 - x0, y1 - y0
+            length = dx * dx + dy * dy
+            t = np.clip(((x - x0) * dx + (y - y0) * dy) / length, 0, 1) if length > 0 else 0
+            occupied |= (x - x0 - t * dx) ** 2 + (y - y0 - t * dy) ** 2 <= radius ** 2
+        for x_center, y_center, radius in openings:
+            occupied &= (x - x_center) ** 2 + (y - y_center) ** 2 > radius ** 2
+        return occupied
+
+    @staticmethod
+    def spread(fill, free):
+        """Fill every run of free cells of a row that has a filled cell."""
+        rows, columns = free.shape
+        free = free.ravel()
+        starts = free.copy()
+        starts[1:] &= ~free[:-1]
+        starts[::columns] = free[::columns]  # A run never continues on the next row
+        run = np.cumsum(starts) - 1
+        filled = np.bincount(run[fill.ravel() & free], minlength=int(starts.sum()) + 1) > 0
+        return (free & filled[np.maximum(run, 0)]).reshape(rows, columns)
+
+    def flood(self, x, y):
+        """Fill the free cells connected to a point, return the number of filled cells."""
+        free = ~self.obstacles
+        fill = np.zeros(free.shape, dtype=bool)
+        row = min(max(int((y - self.y0) / self.cell), 0), self.rows - 1)
+        column = min(max(int((x - self.x0) / self.cell), 0), self.columns - 1)
+        fill[row, column] = free[row, column]
+        count = -1
+        while fill.sum() != count:
+            count = fill.sum()
+            fill = self.spread(fill, free)
+            fill = self.spread(np.ascontiguousarray(fill.T), np.ascontiguousarray(free.T)).T
+        self.fill = np.ascontiguousarray(fill)
+        return int(count)
+
+    def outlines(self):
+        """Return the rings of the fill outline as (x, y) lists in mm, the outer ring first and then the holes."""
+        padded = np.zeros((self.rows + 2, self.columns + 2), dtype=bool)
+        padded[1:-1, 1:-1] = self.fill
+        edges = {}  # Cell corner (column, row) -> directions of the outline edges leaving it
+        for direction, neighbour, corner in (
+            ((1, 0), padded[:-2, 1:-1], (0, 0)),  # Top edges, left to right
+            ((0, 1), padded[1:-1, 2:], (1, 0)),  # Right edges, downwards
+            ((-1, 0), padded[2:, 1:-1], (1, 1)),  # Bottom edges, right to left
+            ((0, -1), padded[1:-1, :-2], (0, 1)),  # Left edges, upwards
+        ):
+            rows, columns = np.nonzero(self.fill & ~neighbour)
+            for start in zip((columns + corner[0]).tolist(), (rows + corner[1]).tolist()):
+                edges.setdefault(start, []).append(direction)
+
+        rings = []
+        while edges:
+            start = next(iter(edges))
+            first = edges[start][0]
+            corner, direction = start, first
+            ring = [start]
+            while True:
+                corner = (corner[0] + direction[0], corner[1] + direction[1])
+                directions = edges[corner]
+                # Where two filled cells only share a corner, cross over to the other cell so the
+                # rings touch at the corner instead of a ring touching itself
+                turn = (direction[1], -direction[0])
+                following = turn if turn in directions else directions[0]
+                if corner == start and following == first:
+                    break
+                directions.remove(following)
+                if not directions:
+                    del edges[corner]
+                if following != direction:
+                    ring.append(corner)
+                direction = following
+            edges[start].remove(first)
+            if not edges[start]:
+                del edges[start]
+            if direction == first:
+                ring.pop(0)  # The start is in the middle of an edge
+            rings.append(([self.x0 + column * self.cell for column, row in ring] + [self.x0 + ring[0][0] * self.cell],
+                          [self.y0 + row * self.cell for column, row in ring] + [self.y0 + ring[0][1] * self.cell]))
+
+        # The fill is connected, so the ring enclosing the largest area is its outer ring
+        areas = [abs(np.dot(x[:-1], y[1:]) - np.dot(x[1:], y[:-1])) for x, y in rings]
+        return [rings[index] for index in sorted(range(len(rings)), key=lambda index: -areas[index])]
+
+    def hatch(self, pitch, cross=True):
+        """Return hatch lines (x0, y0, x1, y1) in mm through the filled cells, every pitch mm."""
+        lines = []
+        step = max(int(round(pitch / self.cell)), 1)
+        for row in range(step // 2, self.rows, step):
+            changes = np.flatnonzero(np.diff(np.concatenate(([0], self.fill[row].astype(np.int8), [0]))))
+            for first, last in zip(changes[0::2], changes[1::2] - 1):
+                if last > first:
+                    lines.append((self.x_cells[first], self.y_cells[row], self.x_cells[last], self.y_cells[row]))
+        if cross:
+            for column in range(step // 2, self.columns, step):
+                changes = np.flatnonzero(np.diff(np.concatenate(([0], self.fill[:, column].astype(np.int8), [0]))))
+                for first, last in zip(changes[0::2], changes[1::2] - 1):
+                    if last > first:
+                        lines.append((self.x_cells[column], self.y_cells[first], self.x_cells[column], self.y_cells[last]))
+        return lines
+
+
+def ground_net(pin_rows, tag, pin):
+    """Return the pins (tag, pin index) and the trace tags connected to a pin, from Pins_Coordinates rows."""
+    pins = set([(tag, pin)])
+    traces = set()
+    grown = True
+    while grown:
+        grown = False
+        for row in pin_rows:
+            if len(row) < 6 or row[4] == "" or row[5] == "":
+                continue
+            key = (row[3], int(row[4]))
+            if key in pins and row[5] not in traces:
+                traces.add(row[5])
+                grown = True
+            if row[5] in traces and key not in pins:
+                pins.add(key)
+                grown = True
+    return pins, traces
+
+
+def ground_fill(path, tag, pin, layer=0, clearance=0.5, cell=0.25, hatch=None, trace_width=None, pad_diameter=1.0,
+                filename_pp="Pick_and_place_components_with_pads.csv", scaling_factor=SCALING_FACTOR):
+    """Fill a layer of a design folder with ground, connected to a pin, and write it as Fill_<design>.csv.
+
+    Obstacles are the traces of the layer, and on the first layer the component outlines and
+    pins (only vias on the other layers), grown by the clearance in mm. The traces and pins of
+    the ground net are not obstacles. With hatch, the fill is also written as hatch traces
+    every hatch mm on the layer, tagged hatch_N. The hatch of a previous fill of the layer is
+    removed first, so it is neither an obstacle nor kept next to the new one. The obstacles are
+    saved in Fill_<design>_<layer>.npz, so the next fill only rasterizes the tiles touched
+    since. Returns the engine, the outline rings and the hatch lines. Raises ValueError, before
+    any file is changed, if no component has the tag or the pin is not one of its pins.
+    """
+    filename, filename_pp_coord, filename_base, filename_pins_selected, filename_layers = design_filenames(path)
+
+    # Check the ground pin before changing any file
+    header, component_rows = read_csv_rows(filename_pp_coord)
+    footprints = [
+        place_footprint(filename_pp, float(row[1]), float(row[2]), 20, row[0], math.radians(float(row[3])), scaling_factor)
+        for row in component_rows
+    ]
+    ground_rows = [index for index, row in enumerate(component_rows) if row[6] == tag]
+    if not ground_rows:
+        raise ValueError("{}: no component with the tag {}".format(path, tag))
+    pin_count = len(footprints[ground_rows[0]][0])
+    if not 0 <= pin < pin_count:
+        raise ValueError("{}: {} has no pin {}, its pins are 0 to {}".format(path, tag, pin, pin_count - 1))
+
+    layers = LayerStack.read(filename_layers)
+    layers.ensure(layer)
+    x_base, y_base = read_base(filename_base)
+    name = os.path.basename(os.path.normpath(path))
+    filename_engine = os.path.join(path, "Fill_{}_{}.npz".format(name, layer))
+    filename_fill = os.path.join(path, "Fill_{}.csv".format(name))
+    engine = GroundFill.read(filename_engine, [value / scaling_factor for value in x_base], [value / scaling_factor for value in y_base], cell)
+
+    # Traces, without the hatch of a previous fill of the layer
+    header, trace_rows = read_csv_rows(filename)
+    old_hatch = set(row[3] for row in trace_rows if row[3].startswith("hatch_") and layers.layer(row[0]) == layer)
+    trace_rows = [row for row in trace_rows if row[3] not in old_hatch]
+
+    pins_header, pin_rows = read_csv_rows(filename_pins_selected) if os.path.exists(filename_pins_selected) else ([], [])
+    if any(len(row) > 5 and row[5] in old_hatch for row in pin_rows):
+        pin_rows = [row for row in pin_rows if len(row) < 6 or row[5] not in old_hatch]
+        write_csv_rows(filename_pins_selected, pins_header, pin_rows)
+    net_pins, net_traces = ground_net(pin_rows, tag, pin)
+
+    # Components and pins
+    rectangles = []
+    discs = []
+    openings = []
+    for row, footprint in zip(component_rows, footprints):
+        x_pins = np.asarray(footprint[0]) / scaling_factor
+        y_pins = np.asarray(footprint[1]) / scaling_factor
+        if row[6] == tag:
+            ground = (x_pins[pin], y_pins[pin])
+        if layer != 0 and row[0] != "Via":
+            continue
+        x_perimeter = parse_coordinates(row[4])
+        y_perimeter = parse_coordinates(row[5])
+        rectangles.append((
+            min(x_perimeter) / scaling_factor - clearance, min(y_perimeter) / scaling_factor - clearance,
+            max(x_perimeter) / scaling_factor + clearance, max(y_perimeter) / scaling_factor + clearance,
+        ))
+        for index in range(len(x_pins)):
+            disc = (x_pins[index], y_pins[index], pad_diameter / 2.0 + clearance)
+            if (row[6], index) in net_pins:
+                openings.append(disc)
+            else:
+                discs.append(disc)
+
+    # Traces of the layer
+    segments = []
+    for row in trace_rows:
+        if layers.layer(row[0]) != layer or row[3] in net_traces:
+            continue
+        width = layers.widths[layer] / float(scaling_factor) if trace_width is None else trace_width
+        x = np.asarray(parse_coordinates(row[1])) / scaling_factor
+        y = np.asarray(parse_coordinates(row[2])) / scaling_factor
+        for k in range(len(x) - 1):
+            segments.append((x[k], y[k], x[k + 1], y[k + 1], width / 2.0 + clearance))
+
+    engine.set_obstacles(rectangles, discs, segments, openings)
+    engine.write(filename_engine)
+    engine.flood(ground[0], ground[1])
+    outlines = engine.outlines()
+
+    # Fill outlines, replacing the previous fill of the layer
+    header, fill_rows = read_csv_rows(filename_fill) if os.path.exists(filename_fill) else ([], [])
+    fill_rows = [row for row in fill_rows if int(row[0]) != layer]
+    for ring, (x, y) in enumerate(outlines):
+        fill_rows.append([layer, ring, [round(value * scaling_factor, 2) for value in x], [round(value * scaling_factor, 2) for value in y]])
+    write_csv_rows(filename_fill, ["Layer", "Ring", "X", "Y"], fill_rows)
+
+    # Hatch traces, tagged after the hatch of the other layers
+    lines = []
+    if hatch is not None:
+        lines = engine.hatch(hatch)
+        numbers = [int(row[3].split("_")[-1]) for row in trace_rows if row[3].startswith("hatch_") and row[3].split("_")[-1].isdigit()]
+        number = max(numbers + [0])
+        for x0, y0, x1, y1 in lines:
+            number += 1
+            trace_rows.append([layer, [round(x0 * scaling_factor, 2), round(x1 * scaling_factor, 2)],
+                               [round(y0 * scaling_factor, 2), round(y1 * scaling_factor, 2)], "hatch_{}".format(number)])
+    if lines or old_hatch:
+        write_csv_rows(filename, ["Tunnel", "X", "Y", "Tag"], trace_rows)
+    return engine, outlines, lines
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Trace Maker GUI")
+    parser.add_argument("--startup-benchmark", action="store_true", help="print the time to the first interactive frame and exit")
+    parser.add_argument("--clean-pins", nargs="+", metavar="DESIGN_FOLDER", help="deduplicate the pin connections of saved designs and exit")
+    parser.add_argument("--auto-place", nargs=2, metavar=("DESIGN_FOLDER", "PARTS_CSV"), help="place the parts inside the design base by simulated annealing and exit")
+    parser.add_argument("--connections", metavar="CONNECTIONS_CSV", help="connections whose wirelength --auto-place minimizes")
+    parser.add_argument("--restarts", type=int, default=4, help="independent annealing restarts run in parallel (default 4)")
+    parser.add_argument("--iterations", type=int, default=20000, help="annealing iterations per restart (default 20000)")
+    parser.add_argument("--force", action="store_true", help="let --auto-place replace the components of a design that has traces or pin connections")
+    parser.add_argument("--panelize", metavar="PANEL_NAME", help="pack copies of --designs on fabrication sheets and exit")
+    parser.add_argument("--designs", nargs="+", metavar="DESIGN_FOLDER[:COPIES]", help="designs and number of copies to panelize")
+    parser.add_argument("--sheet", nargs=2, type=float, metavar=("WIDTH", "HEIGHT"), default=[300.0, 300.0], help="sheet size in mm (default 300 300)")
+    parser.add_argument("--spacing", type=float, default=5.0, help="gap between copies and sheet margin in mm (default 5)")
+    parser.add_argument("--no-rotation", action="store_true", help="do not rotate copies when panelizing")
+    parser.add_argument("--rasterize", metavar="DESIGN_FOLDER", help="render one fabrication mask per layer and exit")
+    parser.add_argument("--dpi", type=int, default=1200, help="mask resolution (default 1200)")
+    parser.add_argument("--trace-width", type=float, help="trace width in mm (default: the width of each layer)")
+    parser.add_argument("--pad-diameter", type=float, default=1.0, help="pad diameter in mm (default 1)")
+    parser.add_argument("--via-diameter", type=float, default=1.2, help="via diameter in mm (default 1.2)")
+    parser.add_argument("--format", choices=["png", "tiff"], default="png", help="mask image format (default png)")
+    parser.add_argument("--tile", type=int, default=2048, help="tile size in pixels rendered by each worker (default 2048)")
+    parser.add_argument("--import-pnp", nargs=2, metavar=("DESIGN_NAME", "PNP_CSV"), help="create a design from an EDA pick-and-place file and exit")
+    parser.add_argument("--netlist", metavar="NETLIST_CSV", help="netlist (Net, Designator, Pin) whose pins --import-pnp records")
+    parser.add_argument("--footprint-map", metavar="MAP_CSV", help="EDA footprint to library component translation (Footprint, Component)")
+    parser.add_argument("--margin", type=float, default=5.0, help="base margin around the imported parts in mm (default 5)")
+    parser.add_argument("--analyze", metavar="DESIGN_FOLDER", help="compute the length and resistance of every trace and exit")
+    parser.add_argument("--sheet-resistance", nargs="+", type=float, metavar="OHM_SQ", default=[0.05], help="sheet resistance in ohm/sq, one value per layer (default 0.05)")
+    parser.add_argument("--strain", type=float, default=0.3, help="uniaxial strain for the strained resistance (default 0.3)")
+    parser.add_argument("--strain-axis", choices=["x", "y"], default="x", help="direction of the strain (default x)")
+    parser.add_argument("--poisson", type=float, default=0.5, help="Poisson ratio of the conductor (default 0.5)")
+    parser.add_argument("--budget", type=float, metavar="OHM", help="flag the traces whose strained resistance is over this value")
+    parser.add_argument("--conductors", metavar="DESIGN_FOLDER", help="merge the trace outlines and pads of every layer into conductor polygons and exit")
+    parser.add_argument("--join", choices=["round", "miter"], default="round", help="join style of the trace outlines (default round)")
+    parser.add_argument("--clearance", type=float, metavar="MM", help="report the conductors closer than this distance")
+    parser.add_argument("--ground-fill", nargs=3, metavar=("DESIGN_FOLDER", "TAG", "PIN"), help="fill a layer with ground connected to a component pin and exit")
+    parser.add_argument("--fill-layer", type=int, default=0, help="layer index of the ground fill (default 0)")
+    parser.add_argument("--fill-clearance", type=float, default=0.5, help="gap between the fill and the other conductors in mm (default 0.5)")
+    parser.add_argument("--cell", type=float, default=0.25, help="cell size of the fill grid in mm (default 0.25)")
+    parser.add_argument("--hatch", type=float, metavar="PITCH", help="also add the fill as cross-hatch traces every PITCH mm")
+    parser.add_argument("--record", metavar="SESSION_CSV", help="record the actions of this GUI session to a log")
+    parser.add_argument("--replay", metavar="SESSION_CSV", help="replay a recorded session at its recorded speed")
+    parser.add_argument("--headless", action="store_true", help="with --replay, replay without window or animation and exit")
+    args = parser.parse_args()
+
+    if args.clean_pins:
+        for path in args.clean_pins:
+            rows_before, rows_after = clean_pin_connections(path)
+            print("{}: {} pin rows -> {} connections".format(path, rows_before, rows_after))
+        sys.exit(0)
+
+    if args.auto_place:
+        try:
+            wirelength, overlap = auto_place(
+                args.auto_place[0], args.auto_place[1], args.connections, args.restarts, args.iterations, args.force
+            )
+        except ValueError as e:
+            sys.exit(str(e))
+        print("Wirelength: {:.1f} px, overlap: {:.1f} px^2".format(wirelength, overlap))
+        sys.exit(0)
+
+    if args.panelize:
+        designs = []
+        for design in args.designs:
+            path, copies = (design.rsplit(":", 1) + ["1"])[:2]
+            designs.append((path, int(copies)))
+        try:
+            sheets, not_placed = panelize(
+                args.panelize, designs, args.sheet[0], args.sheet[1], args.spacing, not args.no_rotation
+            )
+        except ValueError as e:
+            sys.exit(str(e))
+        for path, utilization in sheets:
+            print("{}: {:.1f}% of the sheet used".format(path, 100 * utilization))
+        if sheets:
+            print("Average utilization: {:.1f}% over {} sheet(s)".format(
+                100 * sum(utilization for path, utilization in sheets) / len(sheets), len(sheets)))
+        if not_placed:
+            print("{} copies are larger than the sheet and were not placed".format(not_placed))
+        sys.exit(0)
+
+    if args.rasterize:
+        for output in rasterize(
+            args.rasterize, args.dpi, args.trace_width, args.pad_diameter, args.via_diameter, args.format, args.tile
+        ):
+            print(output)
+        sys.exit(0)
+
+    if args.import_pnp:
+        placed, skipped, skipped_pins = import_pick_and_place(
+            args.import_pnp[0], args.import_pnp[1], args.netlist, args.footprint_map, args.margin
+        )
+        print("{} parts placed in ./{}".format(placed, args.import_pnp[0]))
+        if skipped:
+            print("Footprints not in the library, skipped: {}".format(", ".join(skipped)))
+        if skipped_pins:
+            print("Netlist pins that are not a footprint pin number, skipped: {}".format(", ".join(skipped_pins)))
+        sys.exit(0)
+
+    if args.analyze:
+        table, layer_lengths = analyze_traces(
+            args.analyze, args.sheet_resistance, args.trace_width, args.strain, args.strain_axis, args.poisson, args.budget
+        )
+        print(table.to_string(index=False, float_format=lambda value: "{:.3f}".format(value)))
+        print("")
+        print(layer_lengths.to_string(float_format=lambda value: "{:.3f}".format(value)))
+        if args.budget is not None:
+            print("{} trace(s) over {} ohm".format(int(table["Over budget"].sum()), args.budget))
+        sys.exit(0)
+
+    if args.conductors:
+        polygons, layers = conductor_polygons(args.conductors, args.join, args.trace_width, args.pad_diameter, args.via_diameter)
+        name = os.path.basename(os.path.normpath(args.conductors))
+        write_conductors(os.path.join(args.conductors, "Conductors_{}.csv".format(name)), polygons, layers)
+        for layer in sorted(polygons):
+            print("{}: {} conductors, {:.2f} mm^2".format(
+                layers.names[layer], len(polygons[layer]), sum(polygon.area for polygon in polygons[layer])))
+        if args.clearance is not None:
+            violations = clearance_violations(polygons, args.clearance)
+            for layer, i, j, distance in violations:
+                print("{}: conductors {} and {} are {:.3f} mm apart".format(layers.names[layer], i, j, distance))
+            print("{} clearance violation(s) under {} mm".format(len(violations), args.clearance))
+        sys.exit(0)
+
+    if args.ground_fill:
+        if not args.ground_fill[2].isdigit():
+            sys.exit("--ground-fill: the pin must be a pin index, not {}".format(args.ground_fill[2]))
+        try:
+            engine, outlines, lines = ground_fill(
+                args.ground_fill[0], args.ground_fill[1], int(args.ground_fill[2]), args.fill_layer, args.fill_clearance,
+                args.cell, args.hatch, args.trace_width, args.pad_diameter
+            )
+        except ValueError as e:
+            sys.exit(str(e))
+        print("{:.2f} mm^2 filled, outline of {} rings, {} hatch traces".format(
+            engine.fill.sum() * engine.cell ** 2, len(outlines), len(lines)))
+        sys.exit(0)
+
     root = tk.Tk()
-    app = TraceMakerApp(root)
-    root.mainloop()
\ No newline at end of file
+    session = SessionLog(args.record) if args.record else None
+    app = TraceMakerApp(root, session)
+    if args.startup_benchmark:
+        root.after_idle(app.report_first_frame)
+    if args.replay:
+        events = SessionLog.read(args.replay)
+        if args.headless:
+            root.withdraw()
+            app.replay(events, headless=True)
+            sys.exit(0)
+        app.replay(events)
+    root.mainloop()
+    if session is not None:
+        session.close()
\ No newline at end of file